@@ -21,6 +21,7 @@
 
 
 import getopt
+import logging
 import sys
 
 
@@ -33,6 +34,7 @@ def usage():
     print("-P, --port  server port number")
     print("-r, --retry retry connecting to server")
     print("-C, --chunks chunks per request to server (default 5)")
+    print("-v, --verbose log details of messages sent to the server")
 
 
 if __name__ == "__main__":
@@ -41,12 +43,13 @@ if __name__ == "__main__":
 
     argument_list = sys.argv[1:]
     print("argumentList=", argument_list)
-    options = "hH:C:P:r"
-    long_options = ["help", "host", "port", "retry"]
+    options = "hH:C:P:rv"
+    long_options = ["help", "host", "port", "retry", "verbose"]
     skip_ingest = False
     skip_schema = False
     retry = False
     chunks_per_req = 1
+    log_level = logging.INFO
     try:
         arguments, values = getopt.getopt(argument_list, options, long_options)
         print("arguments=", arguments)
@@ -62,9 +65,12 @@ if __name__ == "__main__":
                 retry = True
             elif arg in ("-C", "--chunks"):
                 chunks_per_req = val
+            elif arg in ("-v", "--verbose"):
+                log_level = logging.DEBUG
     except getopt.error as err:
         print(str(err))
         exit(1)
+    logging.basicConfig(level=log_level)
     print(f'server {host}:{port}')
     dg_client = DataGenClient(host, port, retry=retry, chunks_per_req=chunks_per_req)
     dg_client.run()
@@ -21,6 +21,7 @@
 
 from pathlib import Path
 import getopt
+import logging
 import sys
 
 import lsst.dax.distribution.chunklogs as chunklogs
@@ -43,6 +44,7 @@ def usage():
     print('-r, --raw         String describing targets chunk ids such as "0:10000"\n'
           '                  or "0,1,3,466"')
     print('-z, --keepCsv     Hold onto intermediate csv files for debugging.')
+    print('-v, --verbose     Log details of messages and chunk tracking.')
     print('')
     print('If niether -i or -r are specified, target list will include all valid chunks ids.')
     print('If -r and -i are both specified, target list will be union of target file and\n'
@@ -58,8 +60,9 @@ def server():
     """
     argumentList = sys.argv[1:]
     print("argumentList=", argumentList)
-    options = "ha:ksc:g:i:o:r:z"
-    long_options = ["help", "authIngest", "skipIngest", "skipSchema", "configfile", "outDir", "inDir", "raw", "keepCsv"]
+    options = "ha:ksc:g:i:o:r:zv"
+    long_options = ["help", "authIngest", "skipIngest", "skipSchema", "configfile", "outDir", "inDir", "raw", "keepCsv",
+                    "verbose"]
     auth_ingest = ""
     skip_ingest = False
     skip_schema = False
@@ -69,6 +72,7 @@ def server():
     out_dir = ""
     raw = None
     keep_csv = False
+    log_level = logging.INFO
     try:
         arguments, values = getopt.getopt(argumentList, options, long_options)
         print("arguments=", arguments)
@@ -94,9 +98,12 @@ def server():
                 raw = val
             elif arg in ("-z", "--keepCsv"):
                 keep_csv = True
+            elif arg in ("-v", "--verbose"):
+                log_level = logging.DEBUG
     except getopt.error as err:
         print(str(err))
         exit(1)
+    logging.basicConfig(level=log_level)
     print("skip_ingest=", skip_ingest, "skip_schema=", skip_schema, "values=", values)
     print(f"configfile={config_file} in_dir={in_dir} raw={raw}\n")
 
@@ -122,7 +129,7 @@ def server():
         # Throws if targetf not found
         targetf, completedf, assignedf, limbof = chunklogs.ChunkLogs.checkFiles(in_dir)
         print(f"target={targetf} completed={completedf} assigned={assignedf} limbo={limbof}")
-        clfs = chunklogs.ChunkLogs(targetf, completedf, assignedf, limbof, raw)
+        clfs = chunklogs.ChunkLogs(targetf, completedf, assignedf, limbof, raw=raw)
     else:
         clfs = chunklogs.ChunkLogs(None, raw=raw)
 
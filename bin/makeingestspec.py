@@ -151,7 +151,8 @@ def convert_database(database_name, base_path, gen_config):
     gen_config = os.path.join(base_path, gen_config)
 
     with open(sdm_filename) as f:
-        sdm_schema = yaml.load(f.read(), Loader=yaml.FullLoader)
+        # The libyaml based loader is much faster on large schema files.
+        sdm_schema = yaml.load(f, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
     sdm_tables = {schema['name']: schema for schema in sdm_schema['tables']}
 
    # Ingest configuration
@@ -19,8 +19,11 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 import errno
+import functools
 import glob
+import logging
 import os
 import re
 import shutil
@@ -31,10 +34,39 @@ import traceback
 from pathlib import PurePosixPath
 
 from .DataGenConnection import DataGenConnection
-from .DataIngest import DataIngest
+from .DataIngest import AsyncDataIngest, DataIngest
 from lsst.dax.data_generator import DataGenerator
 from lsst.dax.data_generator import TimingDict
 
+_log = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=1)
+def _parseSpecSource(cfg_file_contents):
+    """Run the text of a datagen specification file and return its globals.
+
+    Parameters
+    ----------
+    cfg_file_contents : str
+        The contents of the specification file.
+
+    Returns
+    -------
+    spec_globals : dictionary
+        The global variables defined by the specification file.
+
+    Note
+    ----
+    The result is cached, so the same text is only compiled and run once.
+    """
+    spec_globals = {}
+    exec(compile(cfg_file_contents, '<datagen spec>', 'exec'), spec_globals)
+    assert 'spec' in spec_globals, "Specification file must define a variable 'spec'."
+    assert 'directors' in spec_globals, "Specification file must define a variable 'directors'."
+    assert 'chunker' in spec_globals, "Specification file must define a variable 'chunker'."
+    assert 'edge_width' in spec_globals, "Specification file must define a variable 'edge_width'."
+    return spec_globals
+
 
 class DataGenClient:
     """This class is used to connect to the DataGenServer and build chunks.
@@ -77,10 +109,10 @@ class DataGenClient:
         self.makeDir(self._pt_cfg_dir)
         self.makeDir(self._pregen_dir)
 
-        # Values set from transferred self._cfgFileContents (see _readDatagenConfig)
-        self._spec = None  # spec from exec(self._cfgFileContents)
-        self._directors = None  # directors from exec(self._cfgFileContents)
-        self._chunker = None  # chunker from exec(self._cfgFileContents)
+        # Values set from transferred self._cfg_file_contents (see _readDatagenConfig)
+        self._spec = None  # spec from _parseSpecSource(self._cfg_file_contents)
+        self._directors = None  # directors from _parseSpecSource(self._cfg_file_contents)
+        self._chunker = None  # chunker from _parseSpecSource(self._cfg_file_contents)
         self._edge_width = None  # float Width of edges in edge only generation.
         # DataGenerator, cannot be initialized until '_spec' received from server
         self._data_gen = None
@@ -90,9 +122,12 @@ class DataGenClient:
 
         # Ingest values
         self._ingest = None
+        self._async_ingest = None  # AsyncDataIngest wrapping _ingest
+        self._ingest_loop = None  # event loop running _async_ingest, kept for all chunks
         self._skip_ingest = True
         self._db_name = ''
         self._transaction_id = -1
+        self._chunk_addrs = {}  # ingest worker (host, port) by chunk id for this transaction
         self._keep_csv = True  # keep intermediate files for debugging
 
         # timing information
@@ -111,13 +146,16 @@ class DataGenClient:
             'db'   : str, name of the databse being created
             'skip' : bool, true if ingest is being skipped.
             'keep' : bool, true if intermediate files should be kept.
+            'http2' : bool, true if ingest should use HTTP/2.
 
         Note
         ----
         The keys in ingest_dict should match those in servRespInit and clientRespInit.
         """
         ingd = ingest_dict
-        self._ingest = DataIngest(ingd['host'], ingd['port'], ingd['auth'])
+        self._ingest = DataIngest(ingd['host'], ingd['port'], ingd['auth'], ingd['http2'])
+        self._async_ingest = AsyncDataIngest(self._ingest)
+        self._ingest_loop = asyncio.new_event_loop()
         self._skip_ingest = ingd['skip']
         self._db_name = ingd['db']
         self._keep_csv = ingd['keep']
@@ -221,17 +259,11 @@ class DataGenClient:
         # spec defines tables and columns.
         # chunker defines the partitioning scheme
         # edge_width should be at least as wide as the partitioning overlap.
-        spec_globals = {}
-        exec(self._cfg_file_contents, spec_globals)
-        assert 'spec' in spec_globals, "Specification file must define a variable 'spec'."
-        assert 'directors' in spec_globals, "Specification file must define a variable 'directors'."
-        assert 'chunker' in spec_globals, "Specification file must define a variable 'chunker'."
-        assert 'edge_width' in spec_globals, "Specification file must define a variable 'edge_width'."
+        spec_globals = _parseSpecSource(self._cfg_file_contents)
         self._spec = spec_globals['spec']
         self._directors = spec_globals['directors']
         self._chunker = spec_globals['chunker']
         self._edge_width = spec_globals['edge_width']
-        print("_cfgFileContents=", self._cfg_file_contents)
         print("_spec=", self._spec)
         self._data_gen = DataGenerator(self._spec, self._chunker, pregen_dir=self._pregen_dir)
 
@@ -625,11 +657,9 @@ class DataGenClient:
                     raise RuntimeError("Error calling partitioner")
 
         # Add the tables to the ingest transaction
-        for info in info_list:
-            print("info=", info, "0=", info[0], "1=", info[1])
-            st_time = self._timing_dict.start()
-            self._addChunkToTransaction(chunkId, table=info[0], f_path=info[1])
-            self._timing_dict.end("ingest", st_time)
+        st_time = self._timing_dict.start()
+        self._addChunkToTransaction(chunkId, info_list)
+        self._timing_dict.end("ingest", st_time)
         return True
 
     def _callPartitioner(self, chunk_id, tbl_name, cfg_fname, ovl_dir, files, info_list, index_path=None):
@@ -716,36 +746,38 @@ class DataGenClient:
         self._timing_dict.end("overlap", st_time)
         return index_path
 
-    def _addChunkToTransaction(self, chunk_id, table, f_path):
-        """ Add chunk-table file to the transaction or raise a RuntimeError.
+    def _addChunkToTransaction(self, chunk_id, info_list):
+        """ Add the chunk-table files to the transaction or raise a RuntimeError.
 
         Parameters
         ----------
         chunk_id : int
-            Chunk id number of the file to add to the transaction.
-        table : str
-            Name of the table in the file to add to the transaction.
-        f_path : str
-            The full path to file to add to the transaction.
+            Chunk id number of the files to add to the transaction.
+        info_list : list of tuple
+            Tuples of the table name and the full path to the file
+            with that table's data for the chunk.
 
         Return
         ------
-        out_str : str
-            Output string from program execution.
+        out_strs : list
+            Output from program execution for each file.
 
         Note
         ----
+        The files are sent to the ingest system at the same time.
         The called functions raise RuntimeErrors if they fail.
         """
         if self._skip_ingest:
-            print("skipping ingest", chunk_id, table, f_path)
-            return 0, 'skip'
+            print("skipping ingest", chunk_id, info_list)
+            return ['skip'] * len(info_list)
         t_id = self._transaction_id
-        host, port = self._ingest.getChunkTargetAddr(t_id, chunk_id)
-        print("Sending to", host, ":", port, "info", t_id, table, chunk_id, f_path)
-        out_str = self._ingest.sendChunkToTarget(host, port, t_id, table, f_path)
-        print("Added to Transaction ", host, ":", port, "info", out_str)
-        return out_str
+        _log.debug("Sending %s %s %s", t_id, chunk_id, info_list)
+        chunk_files = [(chunk_id, table, f_path) for table, f_path in info_list]
+        out_strs = self._ingest_loop.run_until_complete(
+            self._async_ingest.addChunksToTransaction(t_id, chunk_files, self._chunk_addrs))
+        print("Added to Transaction", t_id, "chunk", chunk_id, "files", len(out_strs))
+        _log.debug("ingest output %s", out_strs)
+        return out_strs
 
     def _sendIngestedChunksToServer(self, chunks_to_send):
         """Send chunk ids back to the server until the list is empty.
@@ -767,6 +799,9 @@ class DataGenClient:
             chunks_to_send = self._cl_conn.clientReportChunksComplete(chunks_to_send)
             if len(chunks_to_send) == 0:
                 break
+        # Send the timing report and chunk lists now, rather than making
+        # the server wait while local files are cleaned up.
+        self._cl_conn.flush()
 
     def deleteAllKeepConfig(self):
         """Since ingest is complete for this batch, delete everything
@@ -797,6 +832,7 @@ class DataGenClient:
                 try:
                     s.connect((self._host, self._port))
                     connected = True
+                    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
                 except socket.error:
                     print(f"socket failed to connect {self._host}:{self._port}")
                     if not self._retry:
@@ -822,31 +858,31 @@ class DataGenClient:
             fileName = os.path.join(self._target_dir, self._cfg_file_name)
             with open(fileName, "w") as fw:
                 fw.write(self._cfg_file_contents)
-            cfg_success, pCfgDict = self._cl_conn.clientGetFiles("partition cfg")
+            cfg_success, pCfgList = self._cl_conn.clientGetFiles("partition cfg")
             if not cfg_success:
                 raise RuntimeError("Client failed to receive partitioner config files.")
             self._pt_cfg_dict = {}
-            for cfg in pCfgDict.items():
-                cfg_fname = cfg[1][0]
+            for cfg in pCfgList:
+                cfg_fname = cfg[0]
                 # Table name should be config name with extenstion removed.
                 ext = PurePosixPath(cfg_fname).suffix
                 if ext != ".cfg":
                     raise RuntimeError(f"Unexpected partitioner config file sent {cfg_fname}")
                 table_name = PurePosixPath(cfg_fname).stem
-                self._pt_cfg_dict[table_name] = cfg[1]
+                self._pt_cfg_dict[table_name] = cfg
             # Write those files to the partitioner config directory
-            for index, cfg_info in pCfgDict.items():
+            for index, cfg_info in enumerate(pCfgList):
                 pCfgName = os.path.join(self._pt_cfg_dir, cfg_info[0])
                 print("writing config", index, "name=", pCfgName)
                 with open(pCfgName, "w") as fw:
                     fw.write(cfg_info[1])
 
             # Read in pregenerated files
-            pregen_success, pregen_dict = self._cl_conn.clientGetFiles("pregen files")
+            pregen_success, pregen_list = self._cl_conn.clientGetFiles("pregen files")
             if not pregen_success:
                 raise RuntimeError("Client failed to receive pregenerated files.")
             # Write pregenerated files to their directory
-            for index, file_info in pregen_dict.items():
+            for index, file_info in enumerate(pregen_list):
                 pregen_name = os.path.join(self._pregen_dir, file_info[0])
                 print("writing pregen", index, "name=", pregen_name)
                 with open(pregen_name, "w") as fw:
@@ -883,6 +919,11 @@ class DataGenClient:
                 # Start the transaction
                 abort = False
                 try:
+                    # Find where all of the chunks will be ingested at once.
+                    self._chunk_addrs = {}
+                    if not self._skip_ingest:
+                        self._chunk_addrs = self._ingest.getChunkTargetAddrs(self._transaction_id,
+                                                                             haveAllCsvChunks)
                     for chunk in haveAllCsvChunks:
                         self._createOverlapTables(chunk)
                         print("created overlap for chunk", chunk)
@@ -914,4 +955,8 @@ class DataGenClient:
                 # Remove files and directories if specified
                 if not self._keep_csv:
                     self.deleteAllKeepConfig()
-
+            self._cl_conn.close()
+            if self._ingest is not None:
+                self._ingest_loop.close()
+                self._async_ingest.close()
+                self._ingest.close()
@@ -19,8 +19,18 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import logging
+import os
+import threading
+
 from lsst.dax.data_generator import TimingDict
 
+_log = logging.getLogger(__name__)
+
+# Without os.sendfile, socket.sendfile falls back to seeking and reading
+# the file, which is not safe when threads share the file object.
+_fallback_sendfile_lock = threading.Lock()
+
 
 class DataGenError(Exception):
     def __init__(self, msg):
@@ -52,16 +62,23 @@ class DataGenConnection():
     _C_TIMDCT = 'C_TIMDCT'  # client sending timing information
     _C_CKCOMP = 'C_CKCOMP'  # client sending list of chunks completed
     _C_CKCFIN = 'C_CKCFIN'  # marks the end of the list
+    COMPLEXSEP = '~COMP&@&~'  # Used to separate complex strings
+    _COPY_LIMIT = 65536  # File contents at least this big are sent without copying.
 
     def __init__(self, connection):
         self.conn = connection
-        self.maxRecv = 5000         # Max number of bytes to receive at one time
+        # Buffered reader for the connection, one recv can fill it with
+        # several messages.
+        self._rfile = connection.makefile('rb', buffering=131072)
         self.maxChunksInMsg = 1000  # Limit the number of chunks in a msg
         self.SEP = ':'              # Used to separate values in strings
-        self.COMPLEXSEP = '~COMP&@&~'  # Used to separate complex strings
         self.warnings = 0           # Sum of warnings generated by the class
         self._max_msg_print = 1000  # Maximum number of characters to print to log
                                     # for a single message.
+        # Outgoing messages are collected here and sent together when
+        # the connection waits for a reply, or when flush is called.
+        self._send_buf = bytearray()
+        self._send_buf_limit = 65536  # Send right away when the buffer gets this big.
 
     def _send_msg(self, msg_id, msg):
         """Send a message across the connection.
@@ -70,19 +87,114 @@ class DataGenConnection():
         ----------
         msg_id : str
             Id string for the message.
-        msg : str
-            The message to send.
+        msg : str or bytes
+            The message to send. str is sent UTF-8 encoded.
+
+        Note
+        ----
+        The length sent in the header is the length of the encoded message
+        in bytes. The message is buffered, see flush.
         """
-        lenStr = str(len(msg)).zfill(self.MSG_LENSTR_LEN)
-        if len(lenStr) > self.MSG_LENSTR_LEN:
+        try:
+            complete_msg = self._frameMsg(msg_id, msg)
+        except DataGenError:
             self.warnings += 1
+            raise
+        self._send_raw(complete_msg)
+
+    @classmethod
+    def _frameMsg(cls, msg_id, msg):
+        """Return msg_id, the length, and msg as the bytes _send_msg sends.
+
+        Parameters
+        ----------
+        msg_id : str
+            Id string for the message.
+        msg : str or bytes
+            The message. str is UTF-8 encoded.
+
+        Return
+        ------
+        complete_msg : bytes
+            The framed message.
+        """
+        if isinstance(msg, str):
+            msg = msg.encode()
+        return cls._frameHeader(msg_id, len(msg)) + msg
+
+    @classmethod
+    def _frameHeader(cls, msg_id, msg_len):
+        """Return the msg_id and length that start a message msg_len
+        bytes long.
+        """
+        lenStr = str(msg_len).zfill(cls.MSG_LENSTR_LEN)
+        if len(lenStr) > cls.MSG_LENSTR_LEN:
             raise DataGenError("_send_msg msg length too long " + msg_id + " " + lenStr)
-        complete_msg = msg_id + lenStr + msg
-        print('_send_msg~', complete_msg[0:self._max_msg_print], '~')
-        if len(complete_msg) > self._max_msg_print:
-            print('_send_msg printing truncated len=', len(complete_msg))
-        print('conn', self.conn)
-        self.conn.sendall(complete_msg.encode())
+        return (msg_id + lenStr).encode()
+
+    def _send_raw(self, complete_msg):
+        """Send a message already framed by _frameMsg.
+
+        Parameters
+        ----------
+        complete_msg : bytes
+            The framed message.
+        """
+        if _log.isEnabledFor(logging.DEBUG):
+            _log.debug("_send_msg~%s~ len=%d", complete_msg[0:self._max_msg_print], len(complete_msg))
+        if len(complete_msg) >= self._send_buf_limit:
+            # Don't copy large messages into the buffer.
+            self.flush()
+            self.conn.sendall(complete_msg)
+            return
+        self._send_buf += complete_msg
+        if len(self._send_buf) >= self._send_buf_limit:
+            self.flush()
+
+    def _send_file(self, file_obj):
+        """Send the entire contents of file_obj, which must already
+        have been framed.
+
+        Parameters
+        ----------
+        file_obj : file object
+            File opened in binary mode.
+
+        Note
+        ----
+        Where os.sendfile exists the kernel copies the file straight
+        to the socket and the file position is not used.
+        """
+        self.flush()
+        if hasattr(os, 'sendfile'):
+            self.conn.sendfile(file_obj, 0)
+        else:
+            with _fallback_sendfile_lock:
+                self.conn.sendfile(file_obj, 0)
+
+    def flush(self):
+        """Send all buffered messages.
+
+        Note
+        ----
+        This is called before every receive, so it only needs to be
+        called directly when nothing will be received before the
+        connection is closed.
+        """
+        if self._send_buf:
+            self.conn.sendall(self._send_buf)
+            self._send_buf.clear()
+
+    def close(self):
+        """Close the reader and the connection.
+
+        Note
+        ----
+        Buffered messages are not sent, call flush first if they
+        should be.
+        """
+        self._rfile.close()
+        self.conn.close()
 
     def _recv_msg(self):
         """Receive a message sent with _send_msg.
@@ -96,14 +208,14 @@ class DataGenConnection():
         msg_len : int
             The length of the message.
         """
-        msg_id = self._recv_msg_helper(len(self._C_INIT_R))
+        # The other side may be waiting on buffered messages.
+        self.flush()
+        msg_id = self._recv_msg_helper(len(self._C_INIT_R)).decode()
         msg_lenstr = self._recv_msg_helper(self.MSG_LENSTR_LEN)
         msg_len = int(msg_lenstr)
-        print('_recv_msg', msg_id, msg_lenstr)
-        msg = self._recv_msg_helper(msg_len)
-        print('_recv_msg msg~', msg[0:self._max_msg_print], '~')
-        if len(msg) > self._max_msg_print:
-            print('_recv_msg printing truncated len=', len(msg))
+        msg = self._recv_msg_helper(msg_len).decode()
+        if _log.isEnabledFor(logging.DEBUG):
+            _log.debug("_recv_msg %s~%s~ len=%d", msg_id, msg[0:self._max_msg_print], msg_len)
         return msg_id, msg, msg_len
 
     def _recv_msg_helper(self, resp_len):
@@ -112,24 +224,20 @@ class DataGenConnection():
         Parameters
         ----------
         resp_len : int
-            The length of the message being received.
+            The length of the message being received in bytes.
 
         Return
         ------
-        resp : str
-            The entire response message.
-        """
-        parts = []
-        bytesRecv = 0
-        while bytesRecv < resp_len:
-            partEncoded = self.conn.recv(min(resp_len - bytesRecv, self.maxRecv))
-            part = partEncoded.decode()
-            if part == '':
-                self.warnings += 1
-                raise DataGenError("socket connection broken")
-            parts.append(part)
-            bytesRecv += len(part)
-        return ''.join(parts)
+        resp : bytes
+            The entire response message, still encoded. It is decoded
+            as a whole so multi-byte characters split across recv calls
+            are handled correctly.
+        """
+        resp = self._rfile.read(resp_len)
+        if len(resp) < resp_len:
+            self.warnings += 1
+            raise DataGenError("socket connection broken")
+        return resp
 
     def _buildChunksMsg(self, chunk_list):
         """Build the chunk message from chunk_list
@@ -153,7 +261,7 @@ class DataGenConnection():
         It returns the chunk_msg and a list of chunks that were used in making
         the message.
         """
-        print("buildChunksMsg", chunk_list)
+        _log.debug("buildChunksMsg %s", chunk_list)
         chunk_msg = ''
         used_chunks = []
         first = True
@@ -189,9 +297,9 @@ class DataGenConnection():
         problem = False
         msg_split = msg.split(self.SEP)
         if len(msg_split) == 1 and len(msg_split[0]) == 0:
-            print("nothing in msg")
+            _log.debug("nothing in msg")
             return [], problem
-        print("extract msg", msg, "msg_split", msg_split)
+        _log.debug("extract msg %s msg_split %s", msg, msg_split)
         # convert entire list back to int
         msg_ints = []
         try:
@@ -225,7 +333,7 @@ class DataGenConnection():
         """Receive the initialization request from the client.
         """
         msg_id, msg, msg_len = self._recv_msg()
-        print('servReqInit', msg_id, msg)
+        _log.debug("servReqInit %s %s", msg_id, msg)
         if not msg_id == self._C_INIT_R:
             self.warnings += 1
             raise DataGenError('ERROR servRecvInit ' + str(msg_id) + ' ' + msg + ' ' + str(msg_len))
@@ -242,8 +350,8 @@ class DataGenConnection():
             Number of objects to generate per chunk and number of visits.
         seed : int
             Random number seed.
-        cfg_file_contents : str
-            contents of the configguration file
+        cfg_file_contents : str or bytes
+            contents of the configguration file, bytes must be UTF-8 encoded.
         ingest_dict : dictionary
             Dictionary containing information about the ingest system.
             'host' : str, ingest system host name.
@@ -252,22 +360,56 @@ class DataGenConnection():
             'db'   : str, name of the databse being created
             'skip' : bool, True if ingest is being skipped.
             'keep' : bool, True if csv files should be retained.
+            'http2' : bool, optional, True if ingest should use HTTP/2.
 
         Note
         ----
         Parameters for servRespInit are the return values for clientRespInit.
         """
-        sep = self.COMPLEXSEP
-        print("ingest_dict=", ingest_dict)
+        self.servRespInitBuilt(name, self.buildInitSuffix(objects, visits, seed,
+                                                          cfg_file_contents, ingest_dict))
+
+    @classmethod
+    def buildInitSuffix(cls, objects, visits, seed, cfg_file_contents, ingest_dict):
+        """Build the part of the servRespInit message that follows the
+        client name. It is the same for every client, so the server
+        can build it once and use servRespInitBuilt.
+
+        Parameters
+        ----------
+        See servRespInit.
+
+        Return
+        ------
+        init_suffix : bytes
+            The UTF-8 encoded message contents after the client name.
+        """
+        sep = cls.COMPLEXSEP
+        _log.debug("ingest_dict=%s", ingest_dict)
         skip_val = '1' if ingest_dict['skip'] else '0'
         keep_val = '1' if ingest_dict['keep'] else '0'
-        msg = (name + sep + str(objects) + sep + str(visits) + sep + str(seed)
-               + sep + cfg_file_contents
-               + sep + ingest_dict['host'] + sep + str(ingest_dict['port'])
-               + sep + ingest_dict['auth']
-               + sep + ingest_dict['db']
-               + sep + skip_val + sep + keep_val)
-        self._send_msg(self._S_INIT_R, msg)
+        http2_val = '1' if ingest_dict.get('http2', False) else '0'
+        if isinstance(cfg_file_contents, str):
+            cfg_file_contents = cfg_file_contents.encode()
+        return ((sep + str(objects) + sep + str(visits) + sep + str(seed) + sep).encode()
+                + cfg_file_contents
+                + (sep + ingest_dict['host'] + sep + str(ingest_dict['port'])
+                   + sep + ingest_dict['auth']
+                   + sep + ingest_dict['db']
+                   + sep + skip_val + sep + keep_val + sep + http2_val).encode())
+
+    def servRespInitBuilt(self, name, init_suffix):
+        """Respond to the client initialization request using a message
+        built by buildInitSuffix.
+
+        Parameters
+        ----------
+        name : str
+            name of the client
+        init_suffix : bytes
+            Return value of buildInitSuffix.
+        """
+        self._send_msg(self._S_INIT_R, name.encode() + init_suffix)
 
     def clientRespInit(self):
         """Unwrap the configuration information sent by the server.
@@ -302,6 +444,8 @@ class DataGenConnection():
         ingest_dict['skip'] = bool(skip_val != '0')
         keep_val = splt_msg[10]
         ingest_dict['keep'] = bool(keep_val != '0')
+        http2_val = splt_msg[11]
+        ingest_dict['http2'] = bool(http2_val != '0')
         return name, objects, visits, seed, cfg_file_contents, ingest_dict
 
     def clientGetFiles(self, note):
@@ -315,10 +459,11 @@ class DataGenConnection():
 
         Returns
         -------
-        file_dict : dictionary
-            Dictionary with int key and a value consisting of tuple
-            with the first element being the file name and the second
-            element being the contents of the file.
+        success : bool
+            False if the server sent a file for the wrong index.
+        file_list : list of tuple
+            Tuples with the first element being the file name and the
+            second element being the contents of the file, in index order.
 
         Note
         ----
@@ -327,7 +472,7 @@ class DataGenConnection():
         file name.
         """
         index = 0
-        file_dict = {}
+        file_list = []
         fname = "nothing"
         while not fname == "":
             self.clientReqFile(index)
@@ -335,20 +480,20 @@ class DataGenConnection():
             if i != index:
                 self.success = False
                 print("clientGetFiles failed ", note, i, fname, contents)
-                return False, file_dict
+                return False, file_list
             if not fname == "":
-                file_dict[index] = (fname, contents)
+                file_list.append((fname, contents))
             index += 1
-        return True, file_dict
+        return True, file_list
 
-    def servSendFiles(self, file_dict):
+    def servSendFiles(self, file_list):
         """ Send files to the client..
 
         Parameters
         ----------
-        file_dict : dictionary
-            Dictionary with int keys and values that are tuples
-            containing the file name and file contents.
+        file_list : list of tuple
+            Tuples containing the file name and file contents. The
+            index of a file is its position in the list.
 
         Note
         ----
@@ -360,16 +505,80 @@ class DataGenConnection():
         done = False
         while not done:
             index = self.servRespFile()
-            if index in file_dict:
-                file_tpl = file_dict[index]
-                fname = file_tpl[0]
-                contents = file_tpl[1]
+            if 0 <= index < len(file_list):
+                fname, contents = file_list[index]
             else:
                 fname = ""
                 contents = ""
                 done = True
             self.servSendFile(index, fname, contents)
 
+    @classmethod
+    def encodeFiles(cls, file_list):
+        """Build the messages servSendFiles would send for file_list.
+
+        Parameters
+        ----------
+        file_list : list of tuple
+            Tuples containing the file name and file contents.
+
+        Return
+        ------
+        encoded_files : list of tuple
+            The framed message for each file in file_list, for use
+            with servSendEncodedFiles. The message is a tuple of the
+            buffers to send, in order.
+
+        Note
+        ----
+        File contents may be any bytes-like object, such as an mmap, or
+        a file object opened in binary mode. Large contents are not copied,
+        the message for them is the framed header followed by the contents
+        object itself. File objects are sent with sendfile and must stay
+        open, and the same size, while the messages are in use.
+        """
+        encoded_files = []
+        for index, (fname, contents) in enumerate(file_list):
+            if isinstance(contents, str):
+                contents = contents.encode()
+            prefix = cls._fileMsgPrefix(index, fname)
+            if hasattr(contents, 'fileno'):
+                size = os.fstat(contents.fileno()).st_size
+                header = cls._frameHeader(cls._S_PCFG_A, len(prefix) + size)
+                encoded_files.append((header + prefix, contents))
+            elif len(contents) < cls._COPY_LIMIT:
+                encoded_files.append((cls._frameMsg(cls._S_PCFG_A, prefix + contents),))
+            else:
+                header = cls._frameHeader(cls._S_PCFG_A, len(prefix) + len(contents))
+                encoded_files.append((header + prefix, contents))
+        return encoded_files
+
+    def servSendEncodedFiles(self, encoded_files):
+        """Send files to the client using messages built by encodeFiles.
+
+        Parameters
+        ----------
+        encoded_files : list of tuple
+            Return value of encodeFiles.
+
+        Note
+        ----
+        The client sees the same messages as from servSendFiles.
+        """
+        done = False
+        while not done:
+            index = self.servRespFile()
+            if 0 <= index < len(encoded_files):
+                _log.debug("servSendEncodedFiles S_PCFG_A %s", index)
+                for part in encoded_files[index]:
+                    if hasattr(part, 'fileno'):
+                        self._send_file(part)
+                    else:
+                        self._send_raw(part)
+            else:
+                self.servSendFile(index, "", "")
+                done = True
+
     def clientReqFile(self, index):
         """Client request a partitioner configuration file from the server
 
@@ -381,7 +590,7 @@ class DataGenConnection():
             indicates the file does not exist. The number of files varies
             depending on the database.
         """
-        print("clientReqFile C_PCFGR")
+        _log.debug("clientReqFile C_PCFGR")
         self._send_msg(self._C_PCFG_R, str(index))
 
     def servRespFile(self):
@@ -392,7 +601,7 @@ class DataGenConnection():
         index : int
             Indicates which partitioner configuration file the client wants.
         """
-        print("servRespFile C_PCFGR")
+        _log.debug("servRespFile C_PCFGR")
         msg_id, msg, msg_len = self._recv_msg()
         if not msg_id == self._C_PCFG_R:
             self.warnings += 1
@@ -411,13 +620,27 @@ class DataGenConnection():
         file_name : str
             The name of the file at the index. This should be an empty
             string if there is no file at that index.
-        file_contents : str
+        file_contents : str or bytes
             The contents of the configuration file. This may be empty.
+            bytes must be UTF-8 encoded text.
         """
-        print("servSendFile S_PCFG_A", index, file_name, len(file_contents))
-        sep = self.COMPLEXSEP
-        msg = str(index) + sep + file_name + sep + file_contents
-        self._send_msg(self._S_PCFG_A, msg)
+        _log.debug("servSendFile S_PCFG_A %s %s %d", index, file_name, len(file_contents))
+        self._send_msg(self._S_PCFG_A, self._fileMsgBody(index, file_name, file_contents))
+
+    @classmethod
+    def _fileMsgBody(cls, index, file_name, file_contents):
+        """Return the body of a S_PCFG_A message, see servSendFile.
+        """
+        if isinstance(file_contents, str):
+            file_contents = file_contents.encode()
+        return cls._fileMsgPrefix(index, file_name) + file_contents
+
+    @classmethod
+    def _fileMsgPrefix(cls, index, file_name):
+        """Return the part of a S_PCFG_A message body before the file contents.
+        """
+        sep = cls.COMPLEXSEP
+        return (str(index) + sep + file_name + sep).encode()
 
     def clientRespFile(self):
         """Extract file name and contents from the message sent by the server.
@@ -451,7 +674,7 @@ class DataGenConnection():
         max_count : int
             maximum number of chunk ids to be sent in one message.
         """
-        print("clientReqChunks C_CHUNKR")
+        _log.debug("clientReqChunks C_CHUNKR")
         msg = str(max_count)
         self._send_msg(self._C_CHUNKR, msg)
 
@@ -463,7 +686,7 @@ class DataGenConnection():
         max_count : int
             Maximum number of chunk ids to send the client.
         """
-        print("servRecvReqChunks C_CHUNKR")
+        _log.debug("servRecvReqChunks C_CHUNKR")
         msg_id, msg, msg_len = self._recv_msg()
         if not msg_id == self._C_CHUNKR:
             self.warnings += 1
@@ -486,7 +709,7 @@ class DataGenConnection():
         msg_list = []
         msg_list.append(transaction_id)
         msg_list.extend(chunk_list)
-        print("servSendChunks S_CNKLST", msg_list)
+        _log.debug("servSendChunks S_CNKLST %s", msg_list)
         chunk_msg, sent_chunks = self._buildChunksMsg(msg_list)
         self._send_msg(self._S_CNKLST, chunk_msg)
         return sent_chunks
@@ -501,7 +724,7 @@ class DataGenConnection():
         problem : bool
             True if there problems converting str to int.
         """
-        print("clientRecvChunks S_CNKLST")
+        _log.debug("clientRecvChunks S_CNKLST")
         msg_id, msg, msg_len = self._recv_msg()
         if not msg_id == self._S_CNKLST:
             self.warnings += 1
@@ -523,7 +746,7 @@ class DataGenConnection():
             TimingDict object to send.
 
         """
-        print("clientReportTiming C_TIMDCT", timing_dict)
+        _log.debug("clientReportTiming C_TIMDCT %s", timing_dict)
         time_msg = ''
         c_sep = self.COMPLEXSEP
         time_msg += str(timing_dict.count)
@@ -540,7 +763,7 @@ class DataGenConnection():
         timing_dict : TimingDict
             TimingDict object
         """
-        print("servRecvTiming C_TIMDCT")
+        _log.debug("servRecvTiming C_TIMDCT")
         msg_id, msg, msg_len = self._recv_msg()
         if msg_id != self._C_TIMDCT:
             self.warnings += 1
@@ -573,7 +796,7 @@ class DataGenConnection():
             If this list is not empty, it should be fed back into this
             function as chunk_list.
         """
-        print("clientReportChunksComplete C_CKCOMP", chunk_list)
+        _log.debug("clientReportChunksComplete C_CKCOMP %s", chunk_list)
         chunk_msg, completed_chunks = self._buildChunksMsg(chunk_list)
         self._send_msg(self._C_CKCOMP, chunk_msg)
         leftover = []
@@ -597,7 +820,7 @@ class DataGenConnection():
         problem : bool
             True if there were issues with conversions.
         """
-        print("servRecvChunksComplete C_CKCOMP")
+        _log.debug("servRecvChunksComplete C_CKCOMP")
         msg_id, msg, msg_len = self._recv_msg()
         if not msg_id == self._C_CKCOMP:
             if msg_id == self._C_CKCFIN:
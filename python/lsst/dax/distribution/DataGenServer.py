@@ -19,12 +19,20 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import itertools
+import logging
 import os
-import re
+import queue
+import selectors
 import socket
 import threading
+import time
+import types
 import yaml
 
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+
 from .chunktracking import ChunkTracking
 from .chunktracking import GenerationStage
 from .DataGenConnection import DataGenConnection
@@ -32,6 +40,168 @@ from .DataGenConnection import DataGenError
 from .DataIngest import DataIngest
 from lsst.dax.data_generator import TimingDict
 
+_log = logging.getLogger(__name__)
+
+# Use the libyaml based loader when it is available, it is much faster
+# than the pure python loader.
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
+    _log.warning("PyYAML was built without libyaml, using the slower pure python loader.")
+
+
+def _readYaml(file_name):
+    """Return the parsed contents of the yaml file file_name.
+
+    Parameters
+    ----------
+    file_name : str
+        The name of the yaml file to read.
+
+    Returns
+    -------
+    contents : dictionary
+        The parsed contents of the file.
+    """
+    with open(file_name, 'r') as yaml_file:
+        return yaml.load(yaml_file, Loader=_YamlLoader)
+
+
+def _slurp(file_name):
+    """Return the contents of file_name as bytes using a single read.
+    """
+    fd = os.open(file_name, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        return os.read(fd, size)
+    finally:
+        os.close(fd)
+
+
+def _openFile(file_name):
+    """Return the contents of file_name as bytes if it is small,
+    otherwise return the file opened for binary reading.
+    """
+    fh = open(file_name, 'rb')
+    if os.fstat(fh.fileno()).st_size >= DataGenConnection._COPY_LIMIT:
+        return fh
+    with fh:
+        return fh.read()
+
+
+def _loadSpecModule(file_name, source):
+    """Load the datagen.py specification file as a module.
+
+    Parameters
+    ----------
+    file_name : str
+        The name of the specification file, such as fakeGenSpec.py.
+    source : bytes
+        The contents of the specification file.
+
+    Returns
+    -------
+    module : module
+        The loaded module, with 'spec' and 'chunker' among its attributes.
+    """
+    file_name = str(file_name)
+    module = types.ModuleType("datagen_spec")
+    module.__file__ = file_name
+    exec(compile(source, file_name, 'exec'), module.__dict__)
+    return module
+
+
+class ChunkRequestBatcher:
+    """Hand the chunk requests of client threads to ChunkTracking in batches.
+
+    Parameters
+    ----------
+    chunk_tracking : ChunkTracking
+        Answers the requests with get_chunks_for_clients.
+    window : float, optional
+        Seconds to wait for more requests to handle together.
+        The default, 0, only takes requests that are already queued.
+
+    Note
+    ----
+    Client threads call request() and wait on the Future it returns,
+    a single thread runs serve() until stop() is called.
+    """
+
+    def __init__(self, chunk_tracking, window=0):
+        self._chunk_tracking = chunk_tracking
+        self._window = window
+        self._req_q = queue.SimpleQueue()
+
+    def request(self, client_name, client_addr, req_chunk_count):
+        """Queue a request for chunks.
+
+        Parameters
+        ----------
+        client_name : str
+            Name of the client.
+        client_addr : str
+            Address of the client.
+        req_chunk_count : int
+            Number of chunks the client asked for.
+
+        Returns
+        -------
+        future : concurrent.futures.Future
+            Its result is the list of chunks and the transaction id for
+            the client, or the exception raised finding them.
+        """
+        fut = Future()
+        self._req_q.put((client_name, client_addr, req_chunk_count, fut))
+        return fut
+
+    def stop(self):
+        """Make serve() return once the requests already queued are answered.
+        """
+        self._req_q.put(None)
+
+    def serve(self):
+        """Answer the queued requests until stop() is called.
+
+        Note
+        ----
+        Requests already queued, and any that arrive within window
+        seconds, are handed to ChunkTracking together, so the client
+        threads don't each wait on its lock. With the default window
+        of 0 it never waits for more requests.
+        """
+        while True:
+            item = self._req_q.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self._window
+            while True:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        item = self._req_q.get(timeout=remaining)
+                    else:
+                        item = self._req_q.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    # Finish this batch, then stop.
+                    self._req_q.put(None)
+                    break
+                batch.append(item)
+            requests = [(name, addr, count) for name, addr, count, fut in batch]
+            try:
+                results = self._chunk_tracking.get_chunks_for_clients(requests)
+            except Exception as e:
+                results = [e] * len(batch)
+            for (name, addr, count, fut), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    fut.set_exception(result)
+                else:
+                    fut.set_result(result)
+
 
 class DataGenServer:
     """This class is meant to provide clients with the information needed
@@ -81,22 +251,38 @@ class DataGenServer:
         self._skip_ingest = skip_ingest
         self._skip_schema = skip_schema
         self._keep_csv = keep_csv
-        # Set to false to stop accepting and end the program
-        self._loop = True
-        # Sequence count, incremented to provide unique client names
-        self._sequence = 1
-        # lock to protect _sequence, _clients
+        # Set to stop accepting and end the program
+        self._shutdown = threading.Event()
+        # Seconds to wait for a connection before checking _shutdown again.
+        # _stopAccepting normally wakes the accept loops right away.
+        self._accept_timeout = 0.5
+        # Listening sockets, one per accept loop.
+        self._listen_socks = []
+        # Socket send and receive buffer size in bytes.
+        self._sock_buf_size = 262144
+        # Sequence count, provides unique client names. next() on an
+        # itertools.count is atomic, so the accept loops share it without a lock.
+        self._sequence = itertools.count(1)
+        # lock to protect _clients
         self._client_lock = threading.Lock()
-        # Store timing data from clients
+        # Store timing data from clients. Client threads put their
+        # timing data on _timing_q and a single thread combines it.
         self._timing_dict = TimingDict()
-        self._times_lock = threading.Lock()
+        self._timing_q = queue.SimpleQueue()
 
         # Read configuration to set other values.
-        with open(self._cfgFileName, 'r') as cfgFile:
-            self._cfg = yaml.load(cfgFile)
-            print("cfg", self._cfg)
+        self._cfg = _readYaml(self._cfgFileName)
+        _log.debug("cfg %r", self._cfg)
         # The port number the host will listen to.
         self._port = self._cfg['server']['port']
+        # Maximum number of clients served at the same time, other
+        # clients wait for a thread to become available. Client threads
+        # spend most of their time waiting on sockets, so allow several
+        # per cpu.
+        default_workers = max(32, (os.cpu_count() or 1) * 4)
+        self._max_workers = self._cfg['server'].get('maxWorkers', default_workers)
+        # Number of threads accepting connections, each with its own socket.
+        self._accept_threads = self._cfg['server'].get('acceptThreads', 1)
 
         # The arguments that will be passed from server to
         # clients to dax_data_generator/bin/datagen.py.
@@ -109,16 +295,17 @@ class DataGenServer:
         # from server to clients to dax_data_generator/bin/datagen.py.
         fake_cfg_file_name = os.path.join(self._base_cfg_dir, self._cfg['fakeDataGenerator']['cfgFileName'])
         print("fake_cfg_file_name", fake_cfg_file_name)
-        with open(fake_cfg_file_name, 'r') as file:
+        # Kept as bytes, it is only compiled and sent to clients.
+        with open(fake_cfg_file_name, 'rb') as file:
             self._fakeCfgData = file.read()
-        print("fake_cfg_data=", self._fakeCfgData)
+        _log.debug("fake_cfg_data=%r", self._fakeCfgData)
 
         # Get the directory containing partioner configuration files.
         partioner_cfg_dir = os.path.join(self._base_cfg_dir, self._cfg['partitioner']['cfgDir'])
         print("partioner_cfg_dir=", partioner_cfg_dir)
 
         # Read all the files in that directory and their contents.
-        self._partioner_cfg_dict = self._readPartionerCfgDir(partioner_cfg_dir)
+        self._partioner_cfg_files = self._readPartionerCfgDir(partioner_cfg_dir)
 
         # Get ingest sytem information
         transaction_size = self._cfg['fakeDataGenerator']['transaction_size']
@@ -128,32 +315,49 @@ class DataGenServer:
         ingest_auth = self._cfg['ingest']['authKey']
         if ingest_auth is None:
             ingest_auth = ''
+        ingest_http2 = bool(self._cfg['ingest'].get('http2', False))
         self._ingest_dict = {'host': ingest_host, 'port': ingest_port, 'auth': ingest_auth,
-                             'db': self._db_name, 'skip': self._skip_ingest, 'keep': self._keep_csv}
+                             'db': self._db_name, 'skip': self._skip_ingest, 'keep': self._keep_csv,
+                             'http2': ingest_http2}
         # Read ingest config files.
         self._ingest_cfg_dir = os.path.join(self._base_cfg_dir, self._cfg['ingest']['cfgDir'])
         print("ingest addr=", ingest_host, ":", ingest_port)
         print("ingest cfg dir=", self._ingest_cfg_dir)
-        self._ingest = DataIngest(ingest_host, ingest_port, ingest_auth)
-
-        # List of client connection threads
-        self._client_threads = []
+        self._ingest = DataIngest(ingest_host, ingest_port, ingest_auth, ingest_http2)
+        # Everything in the init response but the client name is the
+        # same for all clients, so build it once.
+        self._init_suffix = DataGenConnection.buildInitSuffix(self._objects, self._visits, self._seed,
+                                                              self._fakeCfgData, self._ingest_dict)
+
+        # Thread pool serving client connections and their futures.
+        self._pool = ThreadPoolExecutor(max_workers=self._max_workers)
+        self._client_futures = []
+        # Optional cap on the number of chunks given to a client at once.
+        self._chunks_per_batch = self._cfg['server'].get('chunksPerBatch')
         # Dictionary of clients by client_id
         self._clients = {}
 
         # Build dictionary of info for chunks to send to workers.
-        spec_globals = {}
-        exec(self._fakeCfgData, spec_globals)
-        assert 'spec' in spec_globals, "Specification file must define a variable 'spec'."
-        assert 'chunker' in spec_globals, "Specification file must define a variable 'chunker'."
+        # self._fakeCfgData is sent to the clients, the server gets
+        # 'spec' and 'chunker' by loading the same text as a module.
+        spec_module = _loadSpecModule(fake_cfg_file_name, self._fakeCfgData)
+        assert hasattr(spec_module, 'spec'), "Specification file must define a variable 'spec'."
+        assert hasattr(spec_module, 'chunker'), "Specification file must define a variable 'chunker'."
         # Determine pregenerated file directory
         pregenerated_dir = os.path.join(self._base_cfg_dir, self._cfg['pregenerated']['cfgDir'])
         # Find all tables that have "from_file" defined and put them in a list so they can be sent.
-        self._pregen_file_dict = self._readPreGeneratedFiles(pregenerated_dir, spec_globals['spec'])
+        self._pregen_files = self._readPreGeneratedFiles(pregenerated_dir, spec_module.spec)
+        # The files are the same for every client, build their messages once.
+        self._partioner_cfg_msgs = DataGenConnection.encodeFiles(self._partioner_cfg_files)
+        self._pregen_file_msgs = DataGenConnection.encodeFiles(self._pregen_files)
         # Read in chunker info
-        chunker = spec_globals['chunker']
+        chunker = spec_module.chunker
         self._chunk_tracking = ChunkTracking(chunker, chunk_logs_in, transaction_size, skip_ingest,
                                              skip_schema, log_dir, self._ingest_dict)
+        # Client threads ask for chunks through this, it hands their
+        # requests to ChunkTracking in batches.
+        chunk_req_window = self._cfg['server'].get('chunkRequestWindow', 0)
+        self._chunk_requests = ChunkRequestBatcher(self._chunk_tracking, chunk_req_window)
 
         # Track all client connections so it is possible to
         # determine when the server's job is finished.
@@ -175,36 +379,44 @@ class DataGenServer:
 
         Returns
         -------
-        dictionary :
-            Keys are sequential integers starting at 0
-            Values are tuples of file name and file contents.
+        file_list : list of tuple
+            Tuples of file name and file contents as bytes.
 
         Note
         ----
-        All the files ending with '.csv' will be read in and entries
-        for them will be put in a dictionary with integer keys, and
-        values being a tuple of the file name and file contents. The keys
-        must be sequential and start at 0, as the clients ask for them by
-        by number starting at 0.
+        All the files ending with '.cfg' will be read in and a tuple
+        of the file name and file contents will be put in the list
+        for each of them. Clients ask for the files by their index in
+        the list, starting at 0.
         """
-        entries = os.listdir(partioner_cfg_dir)
-        files = []
-        for e in entries:
-            if os.path.isfile(os.path.join(partioner_cfg_dir, e)):
-                ext = os.path.splitext(e)[1]
-                if ext == '.cfg':
-                    files.append(os.path.basename(e))
-        print("partitionCfg files=", files, entries)
-        file_dict = {}
-        index = 0
-        for f in files:
-            fName = os.path.join(partioner_cfg_dir, f)
-            with open(fName, 'r') as file:
-                file_data = file.read()
-                file_dict[index] = (f, file_data)
-                index += 1
-        print("file_dict", file_dict)
-        return file_dict
+        with os.scandir(partioner_cfg_dir) as entries:
+            files = sorted(e.name for e in entries if e.is_file() and e.name.endswith('.cfg'))
+        print("partitionCfg files=", files)
+        return self._readFiles(partioner_cfg_dir, files)
+
+    def _readFiles(self, file_dir, files):
+        """Read the files in file_dir named in files.
+
+        Parameters
+        ----------
+        file_dir : str
+            Directory containing the files.
+        files : list of str
+            Names of the files to read.
+
+        Returns
+        -------
+        file_list : list of tuple
+            Tuples of file name and file contents as bytes, in the
+            same order as files.
+        """
+        paths = [os.path.join(file_dir, f) for f in files]
+        # Reads release the GIL, so overlap them.
+        with ThreadPoolExecutor(max_workers=max(1, min(8, len(paths)))) as ex:
+            blobs = list(ex.map(_slurp, paths))
+        file_list = list(zip(files, blobs))
+        _log.debug("file_list %r", file_list)
+        return file_list
 
     def _readPreGeneratedFiles(self, pregenerated_dir, spec_globals):
         """ Read in pregenerated files.
@@ -217,55 +429,136 @@ class DataGenServer:
             Configuration dictionary containing the specifications for
             the tables that need to be generated.
 
+        Returns
+        -------
+        file_list : list of tuple
+            Tuples of file name and file contents. Contents are bytes
+            for small files and an open binary file for large files.
+
         Note
         ----
         All tables with "from_table" defined in spec_globals will
-        get an entry in this dictionary. Any problems finding the
+        get an entry in the returned list. Any problems finding the
         files will raise an exception and likely crash the server.
         """
         pregen_file_names = []
         for tbl in spec_globals:
             if "from_file" in spec_globals[tbl]:
                 pregen_file_names.append(spec_globals[tbl]["from_file"])
-        file_dict = {}
-        index = 0
-        for f in pregen_file_names:
-            fname = os.path.join(pregenerated_dir, f)
-            with open(fname, 'r') as file:
-                contents = file.read()
-                file_dict[index] = (f, contents)
-                index += 1
-        print("pregenerated rows=", len(file_dict))
-        return file_dict
+        # These files can be large, keep them open so they can be sent
+        # with sendfile rather than reading them into memory.
+        # close() closes them.
+        file_list = [(f, _openFile(os.path.join(pregenerated_dir, f))) for f in pregen_file_names]
+        print("pregenerated rows=", len(file_list))
+        return file_list
 
-    def _servAccept(self):
-        """Accept connections from clients, spinning up a new thread
-        to handle each one. This ends when there are no more chunk ids
-        to send and all threads have joined.
+    def _makeListenSocket(self):
+        """Return a non-blocking socket listening on self._port.
+
+        Note
+        ----
+        When there is more than one accept thread, SO_REUSEPORT lets
+        each thread bind its own socket to the same port and the kernel
+        spreads new connections across them.
         """
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            # Allow a restarted server to bind while old connections
+            # are still in TIME_WAIT.
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self._accept_threads > 1:
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            # Accepted connections inherit the buffer sizes. The receive
+            # buffer needs to be set before listen() for it to affect the
+            # TCP window.
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self._sock_buf_size)
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self._sock_buf_size)
             s.bind(('', self._port))
             s.listen()
-            while self._loop:
-                conn, addr = s.accept()
-                print('Connected by', addr)
-                if self._loop:
-                    # start new thread
-                    self._client_lock.acquire()
-                    clientName = 'client' + str(self._sequence)
-                    self._sequence += 1
-                    self._client_lock.release()
-                    print("starting thread", clientName, conn, addr)
-                    thrd = threading.Thread(target=self._servToClient, args=(clientName, conn, addr))
-                    self._client_threads.append(thrd)
+            # The listening socket is polled so that the loop can end
+            # without a connection being made.
+            s.setblocking(False)
+        except OSError:
+            s.close()
+            raise
+        return s
+
+    def _acceptLoop(self, s):
+        """Accept connections on the listening socket s, handing each
+        one to the thread pool, until self._shutdown is set.
+        """
+        with selectors.DefaultSelector() as sel:
+            sel.register(s, selectors.EVENT_READ)
+            while not self._shutdown.is_set():
+                for key, events in sel.select(timeout=self._accept_timeout):
+                    try:
+                        conn, addr = s.accept()
+                    except BlockingIOError:
+                        # The connection went away before it was accepted,
+                        # or another accept thread took it.
+                        continue
+                    except OSError as e:
+                        # _stopAccepting shut the socket down.
+                        if self._shutdown.is_set():
+                            break
+                        raise e
+                    # Client connections use blocking reads and writes.
+                    conn.setblocking(True)
+                    # Messages are small requests and replies, don't let
+                    # Nagle's algorithm hold them back. Keepalive finds
+                    # clients that died without closing the connection.
+                    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    conn.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                    print('Connected by', addr)
+                    if self._shutdown.is_set():
+                        conn.close()
+                        break
                     with self._active_client_mtx:
-                        self._active_client_count += 1
-                    thrd.start()
+                        # A pool thread serves a client until it is out of
+                        # chunks, a client past the limit would never be
+                        # served, so refuse it.
+                        full = self._active_client_count >= self._max_workers
+                        if not full:
+                            self._active_client_count += 1
+                    if full:
+                        _log.warning("refusing %s, already serving maxWorkers=%d clients",
+                                     addr, self._max_workers)
+                        conn.close()
+                        continue
+                    clientName = 'client' + str(next(self._sequence))
+                    print("submitting", clientName, conn, addr)
+                    fut = self._pool.submit(self._servToClient, clientName, conn, addr)
+                    self._client_futures.append(fut)
+
+    def _servAccept(self):
+        """Accept connections from clients, handing each one to the
+        thread pool. This ends when there are no more chunk ids
+        to send and all client connections have finished.
+        """
+        if self._accept_threads > 1 and not hasattr(socket, 'SO_REUSEPORT'):
+            print("SO_REUSEPORT not available, using 1 accept thread")
+            self._accept_threads = 1
+        listen_socks = self._listen_socks
+        try:
+            for j in range(self._accept_threads):
+                listen_socks.append(self._makeListenSocket())
+            # This thread runs the accept loop for the first socket.
+            accept_thrds = [threading.Thread(target=self._acceptLoop, args=(ls,))
+                            for ls in listen_socks[1:]]
+            for thrd in accept_thrds:
+                thrd.start()
+            self._acceptLoop(listen_socks[0])
+            for thrd in accept_thrds:
+                thrd.join()
+        finally:
+            for ls in listen_socks:
+                ls.close()
         print("Accept loop shutting down")
-        for j, thrd in enumerate(self._client_threads):
-            print("joining thread", j)
-            thrd.join()
-        print("All threads joined.")
+        self._pool.shutdown(wait=True)
+        for j, fut in enumerate(self._client_futures):
+            if fut.exception() is not None:
+                print("client connection", j, "raised", repr(fut.exception()))
+        print("All client connections finished.")
 
     def _servToClient(self, name, conn, addr):
         """Handle the requests of a single client.
@@ -295,6 +588,8 @@ class DataGenServer:
         # Connection and communication exceptions are caught so
         # other connections can continue.
         out_of_chunks = False
+        sv_conn = None
+        transaction_id = -9999999  # Obviously invalid value, must be negative.
         try:
             print('Connected by', addr, name, conn)
             sv_conn = DataGenConnection(conn)
@@ -303,40 +598,44 @@ class DataGenServer:
             # receive init from client
             sv_conn.servReqInit()
             # server sending back configuration information
-            sv_conn.servRespInit(name, self._objects, self._visits, self._seed,
-                                 self._fakeCfgData, self._ingest_dict)
+            sv_conn.servRespInitBuilt(name, self._init_suffix)
             # client requests partioner configuration files
-            sv_conn.servSendFiles(self._partioner_cfg_dict)
+            sv_conn.servSendEncodedFiles(self._partioner_cfg_msgs)
 
             # Send the pregenerated files to the client
-            sv_conn.servSendFiles(self._pregen_file_dict)
+            sv_conn.servSendEncodedFiles(self._pregen_file_msgs)
 
             # client requesting chunk list
             client_times = None
-            transaction_id = -9999999  # Obviously invalid value, must be negative.
-            while self._loop and not out_of_chunks:
+            while not self._shutdown.is_set() and not out_of_chunks:
                 clientReqChunkCount = sv_conn.servRecvReqChunks()
-                chunksForClient, transaction_id = self._chunk_tracking.get_chunks_for_client(
-                                                  name, addr, clientReqChunkCount)
+                if self._chunks_per_batch:
+                    clientReqChunkCount = min(clientReqChunkCount, self._chunks_per_batch)
+                req_fut = self._chunk_requests.request(name, addr, clientReqChunkCount)
+                chunksForClient, transaction_id = req_fut.result()
                 sv_conn.servSendChunks(chunksForClient, transaction_id)
                 if len(chunksForClient) == 0:
                     print("out of chunks to send, nothing more to send")
                     out_of_chunks = True
-                    conn.close()
+                    sv_conn.flush()
                 else:
                     # receive timing information from client
                     client_times = sv_conn.servRecvTiming()
-                    print("client times ", client_times.report())
+                    if _log.isEnabledFor(logging.DEBUG):
+                        _log.debug("client times %s", client_times.report())
                     if client_times:
-                        with self._times_lock:
-                            self._timing_dict.combine(client_times)
+                        self._timing_q.put(client_times)
                     # receive completed chunks from client
-                    completed_chunks = []
+                    completed_parts = []
                     finished = False
+                    problems = 0
                     while not finished:
                         completedC, finished, problem = sv_conn.servRecvChunksComplete()
-                        print("serv got", completedC, finished, problem)
-                        completed_chunks.extend(completedC)
+                        completed_parts.append(completedC)
+                        problems += problem
+                    completed_chunks = list(itertools.chain.from_iterable(completed_parts))
+                    _log.info("client %s t_id=%s sent=%d got=%d problems=%d", name, transaction_id,
+                              len(chunksForClient), len(completed_chunks), problems)
                     # Pass the client results to chunk tracking
                     self._chunk_tracking.client_results(transaction_id, chunksForClient, completed_chunks)
         except socket.gaierror as e:
@@ -348,18 +647,33 @@ class DataGenServer:
         except DataGenError as e:
             print("breaking connection", addr, name, "DataGenError:", e.msg)
             self._chunk_tracking.abort_and_close(transaction_id)
-
-        print("_servToClient loop is done", addr, name)
-        # Decrement the number of running client connections and
-        # possibly end the program.
-        with self._active_client_mtx:
-            self._active_client_count -= 1
-            if self._active_client_count == 0 and out_of_chunks:
-                # Connect to our own socket to get past the accept
-                # and break the loop.
-                self._loop = False
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as termSock:
-                    termSock.connect(('127.0.0.1', self._port))
+        finally:
+            if sv_conn is not None:
+                sv_conn.close()
+            else:
+                conn.close()
+
+            print("_servToClient loop is done", addr, name)
+            # Decrement the number of running client connections and
+            # possibly end the program, even if an unexpected exception
+            # is on its way out.
+            with self._active_client_mtx:
+                self._active_client_count -= 1
+                if self._active_client_count == 0 and out_of_chunks:
+                    self._stopAccepting()
+
+    def _stopAccepting(self):
+        """Set _shutdown and wake the accept loops by shutting down
+        their listening sockets.
+        """
+        self._shutdown.set()
+        for ls in self._listen_socks:
+            try:
+                ls.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                # Not connected or already closed, the accept loop
+                # still sees _shutdown within _accept_timeout seconds.
+                pass
 
     def connectToIngest(self):
         """Test if ingest is available and send database info if it is.
@@ -382,40 +696,64 @@ class DataGenServer:
             return True
         db_jfile = self._db_name + ".json"
         db_jpath = os.path.join(self._ingest_cfg_dir, db_jfile)
-        print("sending db config to ingest", db_jpath)
-        if not self._ingest.registerDatabase(db_jpath):
-            raise RuntimeError("Failed to send database to ingest.", db_jpath, self._ingest)
         # Find all of the schema files in self._ingest_cfg_dir while
         # ignoring the database config file and file names ending in '_template'.
-        entries = os.listdir(self._ingest_cfg_dir)
         files = []
-        for e in entries:
-            # Skip '_template.json' files
-            reg = re.compile(r".*_template\.json$")
-            m = reg.match(e)
-            if m:
-                continue
-            full_path = os.path.join(self._ingest_cfg_dir, e)
-            if os.path.isfile(full_path):
-                ext = os.path.splitext(e)[1]
-                if ext == '.json':
-                    fname = os.path.basename(e)
-                    if not fname == db_jfile:
-                        files.append(full_path)
-        # Send each config file to ingest
-        for f in files:
-            print("Sending schema file to ingest", f)
-            if not self._ingest.registerTable(f):
-                raise RuntimeError("Failed to send schema file to ingest", f)
+        with os.scandir(self._ingest_cfg_dir) as entries:
+            for e in entries:
+                # Skip '_template.json' files
+                if e.name.endswith('_template.json'):
+                    continue
+                if e.is_file() and e.name.endswith('.json') and e.name != db_jfile:
+                    files.append(e.path)
+        # Send the database and then each schema file to ingest.
+        print("sending db config to ingest", db_jpath)
+        success, failed_path = self._ingest.registerSchemaBundle(db_jpath, files)
+        if failed_path == db_jpath:
+            raise RuntimeError("Failed to send database to ingest.", db_jpath, self._ingest)
+        if not success:
+            raise RuntimeError("Failed to send schema file to ingest", failed_path)
         return True
 
+    def _combineTimes(self):
+        """Combine the timing data put on _timing_q into _timing_dict
+        until None is put on the queue.
+        """
+        while True:
+            client_times = self._timing_q.get()
+            if client_times is None:
+                break
+            self._timing_dict.combine(client_times)
+
+    def close(self):
+        """Close the open pregenerated files and the chunk log files.
+        """
+        self._chunk_tracking.close()
+        self._pregen_file_msgs = []
+        for fname, contents in self._pregen_files:
+            if hasattr(contents, 'close'):
+                contents.close()
+        self._pregen_files = []
+
     def start(self):
         """Start the server and print the results.
         """
         print("Registering database and schema with ingest system.")
         self.connectToIngest()
         print("starting")
-        self._servAccept()
+        timing_thrd = threading.Thread(target=self._combineTimes)
+        timing_thrd.start()
+        chunk_req_thrd = threading.Thread(target=self._chunk_requests.serve)
+        chunk_req_thrd.start()
+        try:
+            self._servAccept()
+        finally:
+            # All client threads are done, stop the helper threads.
+            self._timing_q.put(None)
+            self._chunk_requests.stop()
+            timing_thrd.join()
+            chunk_req_thrd.join()
+            self.close()
         print("Done, generated ", self._chunk_tracking.get_total_chunks_generated())
 
         print("chunks failed chunks:",
@@ -20,9 +20,61 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import asyncio
+import functools
 import json
+import logging
 import requests
 import subprocess
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+_log = logging.getLogger(__name__)
+
+# httpx, with the h2 package, is only needed for HTTP/2.
+try:
+    import h2  # noqa: F401
+    import httpx
+except ImportError:
+    httpx = None
+
+# orjson is faster than json for request and response bodies, but optional.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
+def _serialize(data_json):
+    """Return data_json as a UTF-8 encoded JSON request body.
+    """
+    if orjson is not None:
+        return orjson.dumps(data_json)
+    return json.dumps(data_json, separators=(',', ':')).encode()
+
+
+def _deserialize(content):
+    """Return the object in the JSON response body content.
+    """
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def _parseJson(response):
+    """Return the object in the JSON body of response.
+
+    Note
+    ----
+    This parses the raw bytes of the body. Unlike response.json(), it
+    does not decode the body to text, or guess its encoding, first.
+    """
+    return _deserialize(response.content)
 
 
 class DataIngest():
@@ -37,14 +89,83 @@ class DataIngest():
         Data ingerst server port number.
     auth_key : str, optional
         Authorization key.
+    http2 : bool, optional
+        Use HTTP/2 so concurrent requests share one connection. The ingest
+        service is plain http, so HTTP/2 is used without TLS (h2c with
+        prior knowledge) and the service must accept it.
+        This needs httpx and h2, without them HTTP/1.1 is used.
+
+    Note
+    ----
+    All requests go through one requests.Session, or httpx.Client for
+    HTTP/2, so connections to the ingest system are kept alive and reused.
+    Call close(), or use the object as a context manager, to release them.
+    Each request is logged at debug level, enable it with
+    logging.basicConfig(level=logging.DEBUG).
     """
 
-    def __init__(self, host, port, auth_key=''):
+    def __init__(self, host, port, auth_key='', http2=False):
         self._host = host
         self._port = port
         self._auth_key = auth_key
-        self._base_url = 'http://' + self._host + ':' + str(port) + '/'
+        # Body of requests that only need authorization, it is not modified.
+        self._auth_payload = {'auth_key': self._auth_key}
+        # Set False once the ingest system rejects 'ingest/chunks' as
+        # an unknown or bad request.
+        self._multi_chunk_lookup = True
+        # Ingest worker (host, port) by (transaction_id, chunk_id), least
+        # recently used first. Entries are removed when the transaction ends.
+        self._chunk_addr_cache = OrderedDict()
+        self._chunk_addr_cache_size = 100000
+        self._chunk_addr_lock = threading.Lock()
+        # Lines of qserv-replica-file-ingest output kept by sendChunkToTarget.
+        self._output_tail_lines = 200
+        if http2 and httpx is None:
+            _log.warning("httpx or h2 is not installed, using HTTP/1.1 for ingest.")
+        self._http2 = http2 and httpx is not None
+        self._base_url = f'http://{self._host}:{port}/'
         print("base_url=", self._base_url)
+        # Full urls of the fixed ingest commands.
+        self._urls = {cmd: self._base_url + cmd
+                      for cmd in ('meta/version', 'ingest/database', 'ingest/table', 'ingest/trans',
+                                  'ingest/chunk', 'ingest/chunks')}
+        if self._http2:
+            # One HTTP/2 connection multiplexes many requests, more are only
+            # opened when its streams run out. Keep as many alive as the
+            # HTTP/1.1 pool below so parallel chunk ingest doesn't reconnect.
+            limits = httpx.Limits(max_keepalive_connections=32, max_connections=100)
+            # http1=False makes httpx speak HTTP/2 over plain http (h2c),
+            # otherwise it only uses HTTP/2 when negotiated over TLS.
+            # The transport only retries failed connects, which is safe
+            # for every method.
+            transport = httpx.HTTPTransport(http1=False, http2=True, retries=5, limits=limits)
+            self._session = httpx.Client(http1=False, http2=True, transport=transport, timeout=30)
+        else:
+            self._session = requests.Session()
+            # Retry transient failures here, rather than failing the chunk.
+            # POST starts transactions and registers databases and tables,
+            # repeating one the server may have acted on is not safe, so
+            # POST is only retried when the connection could not be made.
+            # raise_on_status=False hands the last error response to
+            # _requestToIngest once the retries are used up.
+            retry = Retry(total=5, backoff_factor=0.3, status_forcelist=[500, 502, 503, 504],
+                          allowed_methods=['GET', 'PUT'], raise_on_status=False)
+            # Only the ingest host is contacted, so few pools are needed,
+            # but each holds enough connections for parallel chunk ingest.
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32, max_retries=retry)
+            self._session.mount('http://', adapter)
+
+    def close(self):
+        """Close the connections to the ingest system.
+        """
+        self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, e_type, e_value, e_traceback):
+        self.close()
+        return False
 
     def __repr__(self):
         out = ("host=" + self._host + ":" + str(self._port) + " auth_key:****")
@@ -69,8 +190,9 @@ class DataIngest():
             "POST", or "GET"
         ingest_cmd : str
             The command for the ingest system
-        data_json : json
-            json object containing the data. It is not used for 'GET'.
+        data_json : json or bytes
+            json object containing the data, or the already encoded
+            json body. It is not used for 'GET'.
 
         Return
         ------
@@ -83,37 +205,72 @@ class DataIngest():
             Otherwise it is a json object with information about the request.
 
         """
-        url = self._base_url + ingest_cmd
-        print('url=', url, " data=", data_json)
+        url = self._urls.get(ingest_cmd)
+        if url is None:
+            url = self._base_url + ingest_cmd
+        _log.debug("url=%s data=%s", url, data_json)
+        body = None
+        if isinstance(data_json, bytes):
+            body = data_json
+        elif data_json is not None:
+            body = _serialize(data_json)
         if req_type == "PUT":
-            response = requests.put(url, json=data_json)
+            if self._http2:
+                # httpx takes raw bytes as content, data is for form fields.
+                response = self._session.put(url, content=body, headers=_JSON_HEADERS)
+            else:
+                response = self._session.put(url, data=body, headers=_JSON_HEADERS)
         elif req_type == "POST":
-            response = requests.post(url, json=data_json)
+            if self._http2:
+                response = self._session.post(url, content=body, headers=_JSON_HEADERS)
+            else:
+                response = self._session.post(url, data=body, headers=_JSON_HEADERS)
         elif req_type == "GET":
-            response = requests.get(url)
+            response = self._session.get(url)
         else:
             raise ValueError(f"requestToIngest req_type must be one of PUT, POST, or GET. req={req_type}")
         status_code = response.status_code
         success = True
-        # 200 means the put request was at least well formed.
+        # 200 means the put request was at least well formed. Error
+        # replies are not parsed, only the start of the text is logged.
         if status_code != 200:
-            print('ERROR put url=', url, "data=", data_json, 'status=', status_code)
+            _log.error("%s url=%s data=%s status=%s text=%s", req_type, url, data_json, status_code,
+                       response.text[:512])
             success = False
             return success, status_code, None
-        r_json = response.json()
+        r_json = _parseJson(response)
         if not r_json['success']:
-            print('ERROR put url=', url, 'status=', status_code, 'data=', data_json,
-                  'r_json=', r_json)
+            _log.error("%s url=%s status=%s data=%s r_json=%s", req_type, url, status_code, data_json,
+                       r_json)
             success = False
         return success, status_code, r_json
 
+    def _readSchema(self, file_path):
+        """Return the contents of the json file_path with the auth_key
+        set, ready to use as a request body.
+
+        Note
+        ----
+        Any auth_key already in the file is replaced. A ValueError is
+        raised if the file does not contain a json object.
+        """
+        with open(file_path, 'rb') as f:
+            data_json = _deserialize(f.read())
+        if not isinstance(data_json, dict):
+            raise ValueError("Expected a json object in " + file_path)
+        if data_json.get('auth_key', self._auth_key) not in ('', self._auth_key):
+            _log.warning("replacing the auth_key found in %s", file_path)
+        data_json['auth_key'] = self._auth_key
+        return _serialize(data_json)
+
     def registerDatabase(self, db_file_path):
         """ Send the database description to the ingest system.
         """
-        with open(db_file_path, 'r') as db_f:
-            data = db_f.read()
-            data_json = json.loads(data)
-        data_json['auth_key'] = self._auth_key
+        return self._registerDatabaseJson(db_file_path, self._readSchema(db_file_path))
+
+    def _registerDatabaseJson(self, db_file_path, data_json):
+        """Send data_json, the database description read from the file, to the ingest system.
+        """
         success, status_code, r_json = self._requestToIngest("POST", 'ingest/database', data_json)
         if not success:
             print('ERROR while sending databaae ', db_file_path, "r_json=", r_json)
@@ -121,16 +278,52 @@ class DataIngest():
         return True
 
     def registerTable(self, schema_file_path):
-        with open(schema_file_path, 'r') as schema_f:
-            data = schema_f.read()
-            data_json = json.loads(data)
-        data_json['auth_key'] = self._auth_key
+        return self._registerTableJson(schema_file_path, self._readSchema(schema_file_path))
+
+    def _registerTableJson(self, schema_file_path, data_json):
+        """Send data_json, the table schema read from the file, to the ingest system.
+        """
         success, status_code, r_json = self._requestToIngest("POST", 'ingest/table', data_json)
         if not success:
             print('ERROR while sending table schema ', schema_file_path, "r_json=", r_json)
             return False
         return True
 
+    def registerSchemaBundle(self, db_file_path, table_file_paths):
+        """ Send the database description and then the table schemas
+        to the ingest system.
+
+        Parameters
+        ----------
+        db_file_path : str
+            Path to the database json file.
+        table_file_paths : list of str
+            Paths to the table schema json files.
+
+        Return
+        ------
+        success : bool
+            True if everything was registered.
+        failed_path : str or None
+            The file that could not be registered.
+
+        Note
+        ----
+        All the files are read before anything is sent, so a bad file
+        is found before the database is registered. The requests are
+        sent one after the other over the same kept alive connection,
+        the ingest system has no call to register them all at once.
+        """
+        db_json = self._readSchema(db_file_path)
+        table_jsons = [(path, self._readSchema(path)) for path in table_file_paths]
+        if not self._registerDatabaseJson(db_file_path, db_json):
+            return False, db_file_path
+        for path, data_json in table_jsons:
+            print("Sending schema file to ingest", path)
+            if not self._registerTableJson(path, data_json):
+                return False, path
+        return True, None
+
     def startTransaction(self, db_name):
         """ Start an ingest super transaction.
 
@@ -142,12 +335,15 @@ class DataIngest():
             Ingest super transaction id number.
         """
         success, status_code, r_json = self._requestToIngest("POST", 'ingest/trans',
-                                       {'database': db_name, 'auth_key': self._auth_key})
+                                       {**self._auth_payload, 'database': db_name})
         if not success:
             print('ERROR when starting transaction ', db_name, "r_json=", r_json)
             return False, -1
-        id = r_json['databases'][db_name]['transactions'][0]['id']
-        print("transaction id=", id, " r_json=", r_json)
+        # The new transaction is the only one in the reply.
+        transactions = r_json['databases'][db_name]['transactions']
+        id = transactions[0]['id']
+        print("transaction id=", id)
+        _log.debug("startTransaction r_json=%s", r_json)
         return True, id
 
     def endTransaction(self, transaction_id, abort):
@@ -169,13 +365,40 @@ class DataIngest():
         r_json : json or None
             json data from the put operation if status was 200.
         """
-        cmd = 'ingest/trans/%d?abort=%d' % (transaction_id,abort)
-        success, status, r_json = self._requestToIngest("PUT", cmd, {'auth_key': self._auth_key})
+        cmd = f'ingest/trans/{transaction_id}?abort={int(abort)}'
+        success, status, r_json = self._requestToIngest("PUT", cmd, self._auth_payload)
         if not success:
             print("ERROR ending transaction id=", transaction_id, "abort=", abort, "status=", status,
                   "r_json=", r_json)
+        self._forgetChunkAddrs(transaction_id)
         return success, status, r_json
 
+    def _cachedChunkAddr(self, transaction_id, chunk_id):
+        """Return the cached (host, port) for chunk_id, or None.
+        """
+        key = (transaction_id, chunk_id)
+        with self._chunk_addr_lock:
+            addr = self._chunk_addr_cache.get(key)
+            if addr is not None:
+                self._chunk_addr_cache.move_to_end(key)
+            return addr
+
+    def _cacheChunkAddr(self, transaction_id, chunk_id, addr):
+        """Remember addr as the (host, port) for chunk_id.
+        """
+        with self._chunk_addr_lock:
+            self._chunk_addr_cache[(transaction_id, chunk_id)] = addr
+            self._chunk_addr_cache.move_to_end((transaction_id, chunk_id))
+            while len(self._chunk_addr_cache) > self._chunk_addr_cache_size:
+                self._chunk_addr_cache.popitem(last=False)
+
+    def _forgetChunkAddrs(self, transaction_id):
+        """Remove the cached addresses for transaction_id.
+        """
+        with self._chunk_addr_lock:
+            for key in [key for key in self._chunk_addr_cache if key[0] == transaction_id]:
+                del self._chunk_addr_cache[key]
+
     def getChunkTargetAddr(self, transaction_id, chunk_id):
         """ Get the host and port number of the ingest worker for this chunk.
 
@@ -192,18 +415,79 @@ class DataIngest():
             Host name of the ingest worker.
         port : int
             Port number of the ingest worker.
+
+        Note
+        ----
+        Addresses are cached until the transaction ends.
         """
+        addr = self._cachedChunkAddr(transaction_id, chunk_id)
+        if addr is not None:
+            return addr
         cmd = 'ingest/chunk'
-        jdata = {"transaction_id": transaction_id,"chunk": chunk_id,"auth_key": self._auth_key}
+        jdata = {**self._auth_payload, "transaction_id": transaction_id, "chunk": chunk_id}
         success, status_code, r_json = self._requestToIngest("POST", cmd, jdata)
         if not success:
-            print("ERROR failed to get chunk target address", jdata, " r_json=", r_json)
-            raise RuntimeError('Transaction ' + transaction_id
-                               + ' failed to get target address for chunk ' + chunk_id)
+            _log.error("failed to get chunk target address %s r_json=%s", jdata, r_json)
+            raise RuntimeError('Transaction ' + str(transaction_id)
+                               + ' failed to get target address for chunk ' + str(chunk_id))
         host = r_json['location']['host']
         port = r_json['location']['port']
+        self._cacheChunkAddr(transaction_id, chunk_id, (host, port))
         return host, port
 
+    def getChunkTargetAddrs(self, transaction_id, chunk_ids):
+        """ Get the host and port number of the ingest workers for
+        several chunks.
+
+        Parameters
+        ----------
+        transaction_id : int
+            Ingest transaction id number.
+        chunk_ids : iterable of int
+            Chunk id numbers.
+
+        Return
+        ------
+        addrs : dict
+            (host, port) of the ingest worker for each chunk id.
+
+        Note
+        ----
+        All the chunks are looked up with one 'ingest/chunks' request.
+        If the ingest system does not support that, the chunks are
+        looked up with concurrent 'ingest/chunk' requests instead.
+        Raises RuntimeError if an address cannot be found.
+        """
+        addrs = {}
+        missing = []
+        for chunk_id in dict.fromkeys(chunk_ids):
+            addr = self._cachedChunkAddr(transaction_id, chunk_id)
+            if addr is None:
+                missing.append(chunk_id)
+            else:
+                addrs[chunk_id] = addr
+        if not missing:
+            return addrs
+        if self._multi_chunk_lookup:
+            jdata = {**self._auth_payload, "transaction_id": transaction_id, "chunks": missing}
+            success, status_code, r_json = self._requestToIngest("POST", 'ingest/chunks', jdata)
+            if success and 'location' in r_json:
+                for loc in r_json['location']:
+                    addrs[loc['chunk']] = (loc['host'], loc['port'])
+                    self._cacheChunkAddr(transaction_id, loc['chunk'], addrs[loc['chunk']])
+                return addrs
+            if 400 <= status_code < 500 or success:
+                # The ingest system doesn't know the request, don't ask again.
+                _log.warning("ingest/chunks not available, looking up chunks one at a time")
+                self._multi_chunk_lookup = False
+            else:
+                _log.warning("ingest/chunks failed status=%s, looking up chunks one at a time",
+                             status_code)
+        with ThreadPoolExecutor(max_workers=min(16, len(missing))) as executor:
+            found = executor.map(functools.partial(self.getChunkTargetAddr, transaction_id), missing)
+            addrs.update(zip(missing, found))
+        return addrs
+
     def sendChunkToTarget(self, host, port, transaction_id, table, f_path):
         """ Send the file to the ingest worker.
 
@@ -223,19 +507,43 @@ class DataIngest():
         Note
         ----
         This calls the external program 'qserv-replica-file-ingest' to
-        actually send the file.
+        actually send the file. Only the last _output_tail_lines lines of
+        its output are kept and returned.
+        The program has no mode that reads ingest requests from stdin, so
+        it is run once per file. Use IngestTransaction.submit or
+        AsyncDataIngest to overlap the runs.
         """
-        cmd = ('qserv-replica-file-ingest FILE ' + host + ' ' + str(port) + ' '
-            + str(transaction_id) + ' ' + table + ' P ' + f_path + ' --verbose --columns-separator=TAB')
+        args = self._fileIngestArgs(host, port, transaction_id, table, f_path)
+        _log.debug("cmd=%s", args)
+        try:
+            with subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                  stderr=subprocess.STDOUT) as process:
+                tail = deque((line.decode('utf-8', 'replace') for line in process.stdout),
+                             maxlen=self._output_tail_lines)
+        except OSError as exc:
+            raise RuntimeError("ERROR sendChunkToTarget cmd=" + ' '.join(args) + " failed to run " + str(exc))
+        return self._fileIngestResult(args, process.returncode, tail)
+
+    def _fileIngestArgs(self, host, port, transaction_id, table, f_path):
+        """Return the qserv-replica-file-ingest arguments used by
+        sendChunkToTarget.
+        """
+        args = ['qserv-replica-file-ingest', 'FILE', host, str(port), str(transaction_id), table, 'P',
+                f_path, '--verbose', '--columns-separator=TAB']
         if self._auth_key:
-            cmd += ' --auth-key=' + self._auth_key
-        print("cmd=", cmd)
-        process = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        out_str = str(process.stdout)
-        if process.returncode != 0:
-            print("ERROR sendChunkToTarget cmd=", cmd, "out=", out_str)
-            raise RuntimeError("ERROR sendChunkToTarget cmd=" + cmd + " out=" + str(out_str))
-        return process.returncode, out_str
+            args.append('--auth-key=' + self._auth_key)
+        return args
+
+    def _fileIngestResult(self, args, returncode, tail):
+        """Return the sendChunkToTarget result for a finished
+        qserv-replica-file-ingest, or raise RuntimeError if it failed.
+        """
+        out_str = ''.join(tail)
+        if returncode != 0:
+            cmd = ' '.join(args)
+            _log.error("sendChunkToTarget cmd=%s out=%s", cmd, out_str)
+            raise RuntimeError("ERROR sendChunkToTarget cmd=" + cmd + " out=" + out_str)
+        return returncode, out_str
 
 
     def publishDatabase(self, db_name):
@@ -248,24 +556,231 @@ class DataIngest():
         """
         success = False
         cmd = 'ingest/database/' + db_name
-        success, status, r_json = self._requestToIngest("PUT", cmd,
-                                                        {'auth_key': self._auth_key})
+        success, status, r_json = self._requestToIngest("PUT", cmd, self._auth_payload)
         if not success:
             print("ERROR publishing", db_name, "status=", status, "r_json=", r_json)
         return success, status, r_json
 
+
+class AsyncDataIngest:
+    """asyncio interface to DataIngest so independent ingest calls can
+    be in flight at the same time.
+
+    Parameters
+    ----------
+    data_ingest : DataIngest
+        Object used to make the calls.
+    max_workers : int, optional
+        Maximum number of calls in flight at once.
+
+    Note
+    ----
+    The blocking DataIngest REST calls are run in a thread pool, where
+    they share the DataIngest connection pool. This keeps requests as the
+    only HTTP dependency. qserv-replica-file-ingest is run as an asyncio
+    subprocess, so waiting for it does not hold a thread.
+    """
+
+    def __init__(self, data_ingest, max_workers=16):
+        self._ingest = data_ingest
+        self._max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def __repr__(self):
+        return 'async(' + str(self._ingest) + ')'
+
+    def close(self):
+        """Wait for calls in flight and stop the thread pool.
+        """
+        self._executor.shutdown()
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args))
+
+    async def startTransaction(self, db_name):
+        """See DataIngest.startTransaction.
+        """
+        return await self._run(self._ingest.startTransaction, db_name)
+
+    async def endTransaction(self, transaction_id, abort):
+        """See DataIngest.endTransaction.
+        """
+        return await self._run(self._ingest.endTransaction, transaction_id, abort)
+
+    async def getChunkTargetAddr(self, transaction_id, chunk_id):
+        """See DataIngest.getChunkTargetAddr.
+        """
+        return await self._run(self._ingest.getChunkTargetAddr, transaction_id, chunk_id)
+
+    async def getChunkTargetAddrs(self, transaction_id, chunk_ids):
+        """See DataIngest.getChunkTargetAddrs.
+        """
+        return await self._run(self._ingest.getChunkTargetAddrs, transaction_id, chunk_ids)
+
+    async def sendChunkToTarget(self, host, port, transaction_id, table, f_path):
+        """See DataIngest.sendChunkToTarget.
+        """
+        args = self._ingest._fileIngestArgs(host, port, transaction_id, table, f_path)
+        _log.debug("cmd=%s", args)
+        try:
+            process = await asyncio.create_subprocess_exec(*args, stdin=subprocess.DEVNULL,
+                                                           stdout=subprocess.PIPE,
+                                                           stderr=subprocess.STDOUT)
+        except OSError as exc:
+            raise RuntimeError("ERROR sendChunkToTarget cmd=" + ' '.join(args) + " failed to run " + str(exc))
+        tail = deque(maxlen=self._ingest._output_tail_lines)
+        try:
+            async for line in process.stdout:
+                tail.append(line.decode('utf-8', 'replace'))
+            returncode = await process.wait()
+        except asyncio.CancelledError:
+            # Don't leave the program writing into a failed transaction.
+            if process.returncode is None:
+                process.kill()
+            await process.wait()
+            raise
+        return self._ingest._fileIngestResult(args, returncode, tail)
+
+    async def addChunkToTransaction(self, transaction_id, chunk_id, table, f_path):
+        """Find the ingest worker for chunk_id and send it f_path.
+
+        Return
+        ------
+        out : tuple
+            Return value of DataIngest.sendChunkToTarget.
+        """
+        host, port = await self.getChunkTargetAddr(transaction_id, chunk_id)
+        return await self.sendChunkToTarget(host, port, transaction_id, table, f_path)
+
+    async def addChunksToTransaction(self, transaction_id, chunk_files, addrs=None):
+        """Ingest several chunk table files at the same time.
+
+        Parameters
+        ----------
+        transaction_id : int
+            Ingest transaction id number.
+        chunk_files : list of tuple
+            Tuples of chunk id, table name, and file path.
+        addrs : dict, optional
+            Ingest worker (host, port) by chunk id, such as from
+            getChunkTargetAddrs. Chunks not in it are looked up together
+            before any files are sent.
+
+        Return
+        ------
+        outs : list
+            Return value of DataIngest.sendChunkToTarget for each entry
+            in chunk_files.
+
+        Note
+        ----
+        The first RuntimeError raised by an ingest call is raised here,
+        after the other ingest programs have been killed.
+        """
+        addrs = {} if addrs is None else addrs
+        missing = [chunk_id for chunk_id, table, f_path in chunk_files if chunk_id not in addrs]
+        if missing:
+            addrs = {**addrs, **await self.getChunkTargetAddrs(transaction_id, missing)}
+        # Limit how many ingest programs run at once.
+        semaphore = asyncio.Semaphore(self._max_workers)
+
+        async def send(chunk_id, table, f_path):
+            async with semaphore:
+                return await self.sendChunkToTarget(*addrs[chunk_id], transaction_id, table, f_path)
+
+        tasks = [asyncio.ensure_future(send(chunk_id, table, f_path))
+                 for chunk_id, table, f_path in chunk_files]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            # gather doesn't cancel the rest, stop them and wait for them
+            # to finish before reporting the failure.
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+
+class AsyncIngestTransaction():
+    """Async version of IngestTransaction for use with AsyncDataIngest.
+
+    Parameters
+    ----------
+    data_ingest : AsyncDataIngest
+        Object used to talk to the ingest system.
+    db_name : str
+        Name of the database.
+
+    Note
+    ----
+    The transaction is committed when the async with block finishes,
+    and aborted if it raises. RuntimeError is raised if the transaction
+    cannot be started or ended.
+    """
+
+    def __init__(self, data_ingest, db_name):
+        self._data_ingest = data_ingest
+        self._db_name = db_name
+        self._id = -1
+
+    def __repr__(self):
+        out = 'data_ingest(' + str(self._data_ingest) + ") db=" + self._db_name + " id=" + str(self._id)
+        return out
+
+    async def __aenter__(self):
+        success, id = await self._data_ingest.startTransaction(self._db_name)
+        if not success:
+            raise RuntimeError('Transaction failed to start ' + self._db_name)
+        self._id = id
+        print('Transaction started ', self._db_name, self._id)
+        return self._id
+
+    async def __aexit__(self, e_type, e_value, e_traceback):
+        if e_type:
+            print("__aexit__ exception=", e_type, "val=", e_value)
+            await self._data_ingest.endTransaction(self._id, abort=True)
+            return False
+        success, status, content = await self._data_ingest.endTransaction(self._id, abort=False)
+        if not success:
+            print("ERROR Transaction end failed ", self._db_name, self._id, status, content)
+            raise RuntimeError('Transaction failed ' + self._db_name + " trans_id=" + str(self._id)
+                               + " status=" + str(status) + " content=" + str(content))
+        return False
+
+
 class IngestTransaction():
     """RAII object to make sure transactions are closed.
     Throws RunTimeError if transaction cannot be started or closed.
     self.abort needs to be set to False if the elements of the
     transaction are successful before __exit__ is called.
+
+    Parameters
+    ----------
+    data_ingest : DataIngest
+        Object used to talk to the ingest system.
+    db_name : str
+        Name of the database.
+    max_workers : int, optional
+        Maximum number of chunk files from submit() being ingested at once.
+
+    Note
+    ----
+    Chunk files given to submit() are ingested in parallel. Once one
+    fails the rest are skipped, and __exit__ aborts the transaction
+    and raises a RuntimeError. The transaction is also aborted if the
+    with block raises.
     """
 
-    def __init__(self, data_ingest, db_name):
+    def __init__(self, data_ingest, db_name, max_workers=8):
         self._data_ingest = data_ingest
         self._db_name = db_name
         self._id = -1
         self.abort = True
+        self._max_workers = max_workers
+        self._executor = None  # created by the first submit()
+        self._futures = []
+        self._cancel_event = threading.Event()
 
     def __repr__(self):
         out = 'data_ingest(' + str(self._data_ingest) + ") db=" + self._db_name + " id=" + str(self._id)
@@ -280,18 +795,80 @@ class IngestTransaction():
             raise RuntimeError('Transaction failed to start ' + self._db_name + str(self._id))
         return self._id
 
+    def submit(self, chunk_id, table, f_path):
+        """Ingest the file for a chunk's table in the background.
+
+        Parameters
+        ----------
+        chunk_id : int
+            Chunk id number.
+        table : str
+            The name of the table that f_path data should be added to.
+        f_path : str
+            Full path to the file to ingest.
+
+        Return
+        ------
+        future : concurrent.futures.Future
+            Result is the return value of DataIngest.sendChunkToTarget.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers)
+        future = self._executor.submit(self._ingestChunk, chunk_id, table, f_path)
+        self._futures.append(future)
+        return future
+
+    def _ingestChunk(self, chunk_id, table, f_path):
+        """Find the worker for chunk_id and send it f_path, unless
+        another chunk has already failed.
+        """
+        try:
+            if self._cancel_event.is_set():
+                raise RuntimeError('Transaction ' + str(self._id) + ' cancelled before chunk '
+                                   + str(chunk_id) + ' ' + table)
+            host, port = self._data_ingest.getChunkTargetAddr(self._id, chunk_id)
+            if self._cancel_event.is_set():
+                raise RuntimeError('Transaction ' + str(self._id) + ' cancelled before chunk '
+                                   + str(chunk_id) + ' ' + table)
+            return self._data_ingest.sendChunkToTarget(host, port, self._id, table, f_path)
+        except Exception:
+            self._cancel_event.set()
+            raise
+
+    def _waitForChunks(self):
+        """Wait for the submitted chunks and return their errors.
+        """
+        if self._executor is None:
+            return []
+        self._executor.shutdown(wait=True)
+        self._executor = None
+        errors = [str(fut.exception()) for fut in self._futures if fut.exception() is not None]
+        self._futures = []
+        return errors
+
     def __exit__(self, e_type, e_value, e_traceback):
-        success = False
         if e_type:
-            print("__exit__ exception=", e_type, "val=", e_value, "trace=", e_traceback)
-            return False
-        content = None
-        status = -1
-        if self._id > -1:
+            # Don't start chunks that are still waiting.
+            self._cancel_event.set()
+        errors = self._waitForChunks()
+        if e_type is None and not errors and self._id > -1:
+            # Normal path, all the chunks were sent.
             success, status, content = self._data_ingest.endTransaction(self._id, abort=False)
-        if not success:
-            print("ERROR Transaction end failed ", self._db_name, self._id, status, content)
-            raise RuntimeError('Transaction failed ' + self._db_name + " trans_id="+ str(self._id)
-                                + " status=" + str(status) + " content=" + str(content))
-        return True
-
+            if success:
+                return True
+        elif e_type or errors:
+            if self._id > -1:
+                self._data_ingest.endTransaction(self._id, abort=True)
+            if e_type:
+                print("__exit__ exception=", e_type, "val=", e_value, "trace=", e_traceback)
+                return False
+            print("ERROR Transaction aborted ", self._db_name, self._id, errors)
+            raise RuntimeError('Transaction aborted ' + self._db_name + " trans_id=" + str(self._id)
+                               + " failed chunks=" + str(len(errors)) + " first=" + errors[0])
+        else:
+            # There is no transaction to end.
+            status = -1
+            content = None
+        print("ERROR Transaction end failed ", self._db_name, self._id, status, content)
+        raise RuntimeError('Transaction failed ' + self._db_name + " trans_id=" + str(self._id)
+                           + " status=" + str(status) + " content=" + str(content))
@@ -19,8 +19,37 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import logging
 import os
 
+__all__ = ["ChunkListFile", "ChunkLogs"]
+
+_log = logging.getLogger(__name__)
+
+
+def _toRuns(ids):
+    """Yield the runs of consecutive values in ids.
+
+    Parameters
+    ----------
+    ids : iterable of int
+        Chunk id numbers, in any order.
+
+    Returns
+    -------
+    runs : generator of tuple of (int, int)
+        Sorted (first, last) pairs, inclusive, covering exactly ids.
+    """
+    it = iter(sorted(ids))
+    for first in it:
+        last = first
+        for val in it:
+            if val != last + 1:
+                yield first, last
+                first = val
+            last = val
+        yield first, last
+
 
 class ChunkListFile:
     """Read and write a set of chunks to a file.
@@ -32,13 +61,31 @@ class ChunkListFile:
             self._fname = os.path.expanduser(self._fname)
             self._fname = os.path.abspath(self._fname)
         self.file_wopen = False
+        # Kept open after write() so add() can append without reopening.
+        self._append_fp = None
         self.chunk_set = set()
 
     def read(self):
-        with open(self._fname, 'r') as list_file:
-            f_raw = list_file.read()
-        print(f"chunklogs parsing file {self._fname}")
-        self.parse(f_raw)
+        """Read the file and add its chunk ids to chunk_set.
+
+        Note
+        ----
+        The file is parsed a block of whole lines at a time, so the
+        entire file is never held in memory.
+        """
+        _log.debug("chunklogs parsing file %s", self._fname)
+        block_size = 1 << 20
+        with open(self._fname, 'r', buffering=block_size) as list_file:
+            tail = ''
+            block = list_file.read(block_size)
+            while block:
+                block = tail + block
+                # Keep any partial last line for the next block.
+                cut = block.rfind('\n') + 1
+                tail = block[cut:]
+                self.parse(block[:cut])
+                block = list_file.read(block_size)
+        self.parse(tail)
 
     def parse(self, raw, separator='\n'):
         """Parse the raw string for chunk numbers to put in chunk_set.
@@ -55,27 +102,31 @@ class ChunkListFile:
         Note
         ----
         Extra separators are ignored.
+        Files without any ranges are converted in a single pass, leaving
+        the per-token checks to files that need them.
         """
-        split_raw = raw.split(separator)
+        # str.strip drops empty and whitespace only tokens, from extra
+        # separators, before any per-token work.
+        split_raw = filter(str.strip, raw.split(separator))
+        if ':' not in raw:
+            # int() raises ValueError on bad tokens.
+            self.chunk_set.update(map(int, split_raw))
+            return
+        # Convert the single ids together, only ranges need a loop.
+        ranges = []
+        plain = []
         for st in split_raw:
-            if ':' in st:
-                st_split = st.split(':')
-                if len(st_split) != 2:
-                    raise ValueError(f"value error in st={st} {st_split}")
-                val_a = int(st_split[0])
-                val_b = int(st_split[1])
-                if val_a > val_b:
-                    tmp = val_a
-                    val_a = val_b
-                    val_b = tmp
-                for j in range(val_a, val_b + 1):
-                    self.chunk_set.add(j)
-            elif not st or st.isspace():
-                # ignore empty file and multiple separator in a row
-                pass
-            else:
-                val = int(st)
-                self.chunk_set.add(val)
+            (ranges if ':' in st else plain).append(st)
+        self.chunk_set.update(map(int, plain))
+        for st in ranges:
+            st_split = st.split(':')
+            if len(st_split) != 2:
+                raise ValueError(f"value error in st={st} {st_split}")
+            val_a = int(st_split[0])
+            val_b = int(st_split[1])
+            if val_a > val_b:
+                val_a, val_b = val_b, val_a
+            self.chunk_set.update(range(val_a, val_b + 1))
 
     def intersectWithValid(self, valid_ids):
         """Remove all elements from chunk set that are not in valid_ids.
@@ -89,9 +140,10 @@ class ChunkListFile:
         ----
         Partioning scheme chunks are not contiguous, so this function is used
         to remove invalid chunks from the chunk set.
+        valid_ids is not copied into a set, the intersection looks each
+        id up in chunk_set, or walks the smaller set if it is a set.
         """
-        set_valid = set(valid_ids)
-        self.chunk_set.intersection_update(set_valid)
+        self.chunk_set.intersection_update(valid_ids)
 
     def toStr(self):
         """Return a string of self.chunk_set to write to disk.
@@ -100,20 +152,46 @@ class ChunkListFile:
 
     def toStrDsk(self, aset):
         """Return a string of aset to write to disk.
+
+        Note
+        ----
+        Consecutive ids are written as 'a:b' ranges, the same format
+        parse() accepts, so dense sets stay small on disk.
+        """
+        return '\n'.join(str(a) if a == b else f'{a}:{b}' for a, b in _toRuns(aset))
+
+    def toLinesDsk(self, aset):
+        """Yield the lines of aset to write to disk, each ending in '\n'.
+
+        Note
+        ----
+        This is toStrDsk() one line at a time, so large sets can be
+        written without building the whole string.
         """
-        return '' if not aset else '\n'.join(str(j) for j in aset)
+        for a, b in _toRuns(aset):
+            yield f'{a}\n' if a == b else f'{a}:{b}\n'
 
     def write(self):
         """Write the set to file, overwriting previous file.
         """
         if not self._fname:
-            print("ChunkFileList cannot be written since it doesn't have a name.")
+            _log.debug("ChunkFileList cannot be written since it doesn't have a name.")
             return
-        print(f"self._fname {self._fname}")
-        with open(self._fname, 'w') as list_file:
-            list_file.write(self.toStr())
+        _log.debug("writing %s", self._fname)
+        self.close()
+        self._append_fp = open(self._fname, 'w', buffering=1 << 20)
+        self._append_fp.writelines(self.toLinesDsk(self.chunk_set))
+        self._append_fp.flush()
         self.file_wopen = True
 
+    def close(self):
+        """Close the file kept open for appending, if any.
+        """
+        if self._append_fp is not None:
+            self._append_fp.close()
+            self._append_fp = None
+        self.file_wopen = False
+
     def add(self, chunk_ids):
         """Add chunk_ids to the set, if it was not already in the set append to the file.
 
@@ -122,16 +200,19 @@ class ChunkListFile:
         chunk_ids : list of ints
             Chunk id numbers to add to the set and possibly append to the file.
         """
-        print(f"&&& add {self.file_wopen} {self._fname}  {chunk_ids}")
-        needed = [id for id in chunk_ids if id not in self.chunk_set]
+        _log.debug("add %s %s %s", self.file_wopen, self._fname, chunk_ids)
+        # difference() walks the smaller of the two sets.
+        needed = set(chunk_ids).difference(self.chunk_set)
+        if not needed:
+            return
 
         self.chunk_set.update(needed)
 
         # Only write to file if a file has already been opened for writing.
         if self.file_wopen:
-            with open(self._fname, 'a') as list_file:
-                list_file.write('\n' + self.toStrDsk(needed))
-                list_file.flush()
+            # Flush every time so the log is complete if the server dies.
+            self._append_fp.writelines(self.toLinesDsk(needed))
+            self._append_fp.flush()
 
 
 class ChunkLogs:
@@ -206,8 +287,7 @@ class ChunkLogs:
         # chunk Ids should be removed from assigned and limbo logs.
         problem_set = self._assigned.chunk_set.difference(self._completed.chunk_set)
         problem_set.update(self._limbo.chunk_set)
-        notstarted_set = self._target.chunk_set.difference(self._completed.chunk_set)
-        notstarted_set.difference_update(problem_set)
+        notstarted_set = self._target.chunk_set.difference(self._completed.chunk_set, problem_set)
         rpt = f'Problem chunk ids:\n{problem_set}\n\n'
         rpt += f'Log counts:\n'
         rpt += f' Target:     {len(self._target.chunk_set)}\n'
@@ -238,7 +318,7 @@ class ChunkLogs:
         if self._target_raw:
             raw_in = ChunkListFile(None)
             # Use comma for separator since this came from the command line.
-            print(f"chunklogs parsing command line {self._target_raw}")
+            _log.debug("chunklogs parsing command line %s", self._target_raw)
             raw_in.parse(self._target_raw, ',')
 
         if self._target._fname:
@@ -248,30 +328,32 @@ class ChunkLogs:
             self._target.read()
             if raw_in:
                 self._target.chunk_set.intersection_update(raw_in.chunk_set)
+            # Make sure no invalid chunks are in the target set.
+            if all_valid_chunks is not None:
+                self._target.intersectWithValid(all_valid_chunks)
         elif raw_in:
             # Since there's no target file, use provided raw string by itself.
             self._target = raw_in
+            if all_valid_chunks is not None:
+                self._target.intersectWithValid(all_valid_chunks)
         else:
-            # Nothing provided by user, the target is all valid chunks.
+            # Nothing provided by user, the target is all valid chunks,
+            # there is nothing to remove.
             self._target.chunk_set = set(all_valid_chunks)
-        # Make sure no invalid chunks are in the target set.
-        if all_valid_chunks is not None:
-            self._target.intersectWithValid(all_valid_chunks)
 
         # result_set is the target set with all chunks found in
         # complete, assigned, and limbo removed. Technically
         # this could just be target - assigned, but users
         # are expected to edit the files and ingesting the
         # same chunk twice could be bad.
-        self.result_set = self._target.chunk_set.copy()
-
-        # Remove chunks from result_set if they are in completed,
-        # assigned, or limbo.
         lst = [self._completed, self._assigned, self._limbo]
         for item in lst:
             if item._fname:
                 item.read()
-                self.result_set.difference_update(item.chunk_set)
+
+        # Remove chunks from result_set if they are in completed,
+        # assigned, or limbo, in one pass over the target set.
+        self.result_set = self._target.chunk_set.difference(*(item.chunk_set for item in lst))
         return
 
     def write(self):
@@ -282,6 +364,14 @@ class ChunkLogs:
         for item in lst:
             item.write()
 
+    def close(self):
+        """Close the output files.
+        """
+        lst = [self._target, self._completed, self._assigned, self._limbo,
+               self._transactions_started, self._transactions_completed]
+        for item in lst:
+            item.close()
+
     @staticmethod
     def createNames(path_header):
         """Create chunk log file names
@@ -316,13 +406,17 @@ class ChunkLogs:
         transactions_completed = os.path.join(path_header, "transactions_completed.clg")
         return target, completed, assigned, limbo, transactions_started, transactions_completed
 
-    def createOutput(self, path_header):
+    def createOutput(self, path_header, copy=True):
         """Create an output ChunkLogs object base on this one.
 
         Parameters
         ----------
         path_header : str
             path to give to the output files.
+        copy : bool, optional
+            If False, the new object shares the chunk sets with this one
+            instead of copying them. Only use this when this object is
+            not used afterwards, as adding to either changes both.
 
         Note
         ----
@@ -340,13 +434,17 @@ class ChunkLogs:
             path_header = ''
         targf, compf, assif, limbf, tr_st, tr_cm = ChunkLogs.createNames(path_header)
         logs_out = ChunkLogs(targf, compf, assif, limbf, tr_st, tr_cm)
-        logs_out._target.chunk_set = self._target.chunk_set.copy()
-        logs_out._completed.chunk_set = self._completed.chunk_set.copy()
-        logs_out._assigned.chunk_set = self._assigned.chunk_set.copy()
-        logs_out._limbo.chunk_set = self._limbo.chunk_set.copy()
-        logs_out._transactions_started.chunk_set = self._transactions_started.chunk_set.copy()
-        logs_out._transactions_completed.chunk_set = self._transactions_completed.chunk_set.copy()
-        logs_out.result_set = self.result_set.copy()
+
+        def dup(aset):
+            return aset.copy() if copy else aset
+
+        logs_out._target.chunk_set = dup(self._target.chunk_set)
+        logs_out._completed.chunk_set = dup(self._completed.chunk_set)
+        logs_out._assigned.chunk_set = dup(self._assigned.chunk_set)
+        logs_out._limbo.chunk_set = dup(self._limbo.chunk_set)
+        logs_out._transactions_started.chunk_set = dup(self._transactions_started.chunk_set)
+        logs_out._transactions_completed.chunk_set = dup(self._transactions_completed.chunk_set)
+        logs_out.result_set = dup(self.result_set)
         return logs_out
 
     @staticmethod
@@ -372,22 +470,23 @@ class ChunkLogs:
         """
         in_dir = os.path.expanduser(in_dir)
         in_dir = os.path.abspath(in_dir)
-        targf, compf, assif, limbf = ChunkLogs.createNames(in_dir)
+        targf, compf, assif, limbf, _, _ = ChunkLogs.createNames(in_dir)
         # Check if in_dir exists
         if not os.path.exists(in_dir):
             raise FileNotFoundError(in_dir)
         # Check if targf exists
         if os.path.exists(targf):
-            print("found target file {targf}")
+            _log.info("found target file %s", targf)
         else:
             raise FileNotFoundError(targf)
         lst = [compf, assif, limbf]
-        for f in lst:
+        for j, f in enumerate(lst):
             if os.path.exists(f):
-                print(f"found {f}")
+                _log.info("found %s", f)
             else:
-                print(f"not found {f} setting to None")
-                f = None
+                _log.info("not found %s setting to None", f)
+                lst[j] = None
+        compf, assif, limbf = lst
         return targf, compf, assif, limbf
 
     def addAssigned(self, chunk_ids):
@@ -19,7 +19,8 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import itertools
+import collections
+import logging
 import sys
 import threading
 
@@ -27,6 +28,8 @@ from enum import Enum
 
 from .DataIngest import DataIngest
 
+_log = logging.getLogger(__name__)
+
 
 class GenerationStage(Enum):
     """This class is used to indicate where a chunk is in the process
@@ -62,6 +65,9 @@ class ChunkInfo:
         The IP address of the client generating the chunk.
     """
 
+    # There is one of these per chunk, so avoid a __dict__ per instance.
+    __slots__ = ('chunk_id', 'gen_stage', 'client_id', 'client_addr')
+
     def __init__(self, chunk_id):
         self.chunk_id = chunk_id
         self.gen_stage = GenerationStage(GenerationStage.UNASSIGNED)
@@ -76,13 +82,16 @@ class ChunkInfo:
 class Transaction:
     """ Track the chunks in a transaction and the transaction id.
 
-    chunks : set of int
-        chunk ids of the chunks in the transaction.
+    chunks : iterable of int
+        chunk ids of the chunks in the transaction, in the order they
+        should be handed to clients.
     """
 
     def __init__(self, chunks):
-        self.chunks = chunks  # destroyed as chunks moved to transactions.
-        self.total_chunks = chunks.copy()
+        # Chunks not yet given to a client, in the order they are handed out.
+        self._order = collections.deque(chunks)
+        self.chunks = set(self._order)  # destroyed as chunks moved to clients.
+        self.total_chunks = self.chunks.copy()
         self.completed_chunks = set()
         self.id = None  # id number given to the transaction
         self.abort = False
@@ -101,10 +110,33 @@ class Transaction:
         """ Return True if done sending chunks (This does NOT indicate success)
         """
         ret = self.total_chunks == self.completed_chunks or self.abort
-        diff = self.total_chunks ^ self.completed_chunks
-        print(f"is_finished abort={self.abort} ret={ret} len(diff)={len(diff)}")
+        if _log.isEnabledFor(logging.DEBUG):
+            diff = self.total_chunks ^ self.completed_chunks
+            _log.debug("is_finished abort=%s ret=%s len(diff)=%d", self.abort, ret, len(diff))
         return ret
 
+    def take(self, count):
+        """Remove up to count chunks from the front of the transaction.
+
+        Parameters
+        ----------
+        count : int
+            The maximum number of chunks to remove.
+
+        Returns
+        -------
+        chunks : set of int
+            The removed chunk ids. Chunks are handed out in the order
+            given to the constructor, so sorted input gives each client
+            a run of adjacent chunk ids.
+        """
+        ret_set = set()
+        for _ in range(min(count, len(self._order))):
+            chunk = self._order.popleft()
+            self.chunks.discard(chunk)
+            ret_set.add(chunk)
+        return ret_set
+
 
 class ChunkTracking:
     """The set of chunks, with status, to send to the clients with subsets for
@@ -131,29 +163,35 @@ class ChunkTracking:
         # Use provided information to build the set of chunks to generate.
         chunk_logs_in.build(all_chunks)
         # Use the input information/files to create the output logs.
-        self._chunk_logs = chunk_logs_in.createOutput(log_dir)
+        # chunk_logs_in isn't used again, so its sets needn't be copied.
+        self._chunk_logs = chunk_logs_in.createOutput(log_dir, copy=False)
         if log_dir is not None:
             # Start logging
             self._chunk_logs.write()
         # Static set of all chunks to be generated.
         self._chunks_entire_set = self._chunk_logs.result_set.copy()
-        # Set of chunks to send - this is destroyed as chunks are assigned.
-        self._chunks_to_send_set = self._chunk_logs.result_set.copy()
+        # Chunks to send in ascending order - this is destroyed as chunks
+        # are assigned. A deque allows cheap removal from the front.
+        self._chunks_pending = collections.deque(sorted(self._chunk_logs.result_set))
         # Total number of chunks to send, constant.
-        self._chunks_to_send_total = len(self._chunks_to_send_set)
+        self._chunks_to_send_total = len(self._chunks_pending)
         self._limbo_count = 0  # number of chunks that had problems being created.
         # Dictionary of information about chunks being sent.
         # self._chunks_data only includes information about this run.
         # self._chunk_logs may include information from previous runs.
         self._chunks_data = {}
-        for chunk in self._chunks_to_send_set:
+        for chunk in self._chunks_pending:
             chunk_info = ChunkInfo(chunk)
             self._chunks_data[chunk] = chunk_info
+        # Chunk ids indexed by their GenerationStage, kept in step with
+        # ChunkInfo.gen_stage by _set_stage.
+        self._by_state = {stage: set() for stage in GenerationStage}
+        self._by_state[GenerationStage.UNASSIGNED].update(self._chunks_data)
         print("_chunks_to_send_total=", self._chunks_to_send_total)
 
         # Ingest values
         ingd = ingest_dict
-        self._ingest = DataIngest(ingd['host'], ingd['port'], ingd['auth'])
+        self._ingest = DataIngest(ingd['host'], ingd['port'], ingd['auth'], ingd.get('http2', False))
         self._skip_ingest = ingd['skip']
         self._db_name = ingd['db']
 
@@ -175,7 +213,7 @@ class ChunkTracking:
         """ Return the number of chunks left to be generated.
         Note: self._list_lock must be held when calling this function.
         """
-        count = len(self._chunks_to_send_set)
+        count = len(self._chunks_pending)
         if self._transaction:
             count += len(self._transaction.chunks)
         return count
@@ -197,14 +235,7 @@ class ChunkTracking:
         """ Return a string describing the status of all chunks.
         """
         with self._list_lock:
-            counts = {GenerationStage.UNASSIGNED: 0,
-                      GenerationStage.TRANSACTION: 0,
-                      GenerationStage.ASSIGNED: 0,
-                      GenerationStage.FINISHED: 0,
-                      GenerationStage.LIMBO: 0}
-            for chk in self._chunks_data:
-                chk_info = self._chunks_data[chk]
-                counts[chk_info.gen_stage] += 1
+            counts = {stage: len(chunks) for stage, chunks in self._by_state.items()}
         s = f"Chunks generated={counts[GenerationStage.FINISHED]}\n"
         s += f"Chunks transaction={counts[GenerationStage.TRANSACTION]}\n"
         s += f"Chunks assigned={counts[GenerationStage.ASSIGNED]}\n"
@@ -216,28 +247,33 @@ class ChunkTracking:
         """Return a list of ChunkInfo where the gen_stage matches one in
         the provided genState list
         """
+        gen_states = frozenset(genState)
         with self._list_lock:
-            chunks_in_state = []
-            for chk in self._chunks_data:
-                chk_info = self._chunks_data[chk]
-                if chk_info.gen_stage in genState:
-                    chunks_in_state.append(chk_info)
-        return chunks_in_state
+            return [self._chunks_data[chunk] for stage in gen_states for chunk in self._by_state[stage]]
+
+    def _set_stage(self, c_info, stage):
+        """Set the gen_stage of c_info and move it to the matching
+        _by_state set.
+
+        Note: self._list_lock must be held when calling this function.
+        """
+        self._by_state[c_info.gen_stage].discard(c_info.chunk_id)
+        self._by_state[stage].add(c_info.chunk_id)
+        c_info.gen_stage = stage
 
     def _build_next_transaction(self):
-        """Take chunks from _chunks_to_send_set and put them in a new
-        Transaction.
+        """Take chunks from the front of _chunks_pending and put them in
+        a new Transaction.
 
         Note: self._list_lock must be held when calling this function.
         """
-        transaction_chunks = set()
-        for chunk in itertools.islice(self._chunks_to_send_set, self._transaction_size):
-            transaction_chunks.add(chunk)
-            cInfo = self._chunks_data[chunk]
-            cInfo.gen_stage = GenerationStage.TRANSACTION
-        for chunk in transaction_chunks:
-            self._chunks_to_send_set.discard(chunk)
-        print(f"new transaction_chunks {transaction_chunks}")
+        transaction_chunks = []
+        count = min(self._transaction_size, len(self._chunks_pending))
+        for _ in range(count):
+            chunk = self._chunks_pending.popleft()
+            transaction_chunks.append(chunk)
+            self._set_stage(self._chunks_data[chunk], GenerationStage.TRANSACTION)
+        _log.debug("new transaction_chunks %s", transaction_chunks)
         self._transaction = Transaction(transaction_chunks)
 
     def _start_transaction(self):
@@ -334,16 +370,19 @@ class ChunkTracking:
 
         Note: self._list_lock must be held when calling this function
         """
+        self._total_generated_chunks.update(completed_chunks)
         for completed in completed_chunks:
-            self._total_generated_chunks.add(completed)
-            cInfo = self._chunks_data[completed]
-            cInfo.gen_stage = GenerationStage.FINISHED
+            self._set_stage(self._chunks_data[completed], GenerationStage.FINISHED)
 
     def get_chunks_for_client(self, client_name, client_addr, req_chunk_count):
         """Get a list of chunks for a client to generate.
 
         Parameters
         ----------
+        client_name : str
+            Name of the client.
+        client_addr : str
+            Address of the client.
         req_chunk_count :int
             The maximum number of chunks the client wants to recieve.
 
@@ -354,28 +393,69 @@ class ChunkTracking:
         transaction_id : int
             Id number of the current transaction.
         """
+        result = self.get_chunks_for_clients([(client_name, client_addr, req_chunk_count)])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def get_chunks_for_clients(self, requests):
+        """Get chunks for several clients while taking the lock once.
+
+        Parameters
+        ----------
+        requests : list of tuple
+            Each tuple is the client_name, client_addr, and req_chunk_count
+            arguments of get_chunks_for_client.
+
+        Returns
+        -------
+        results : list
+            For each request, either the (chunks_for_client, transaction_id)
+            tuple get_chunks_for_client would return or the RuntimeError
+            raised while getting the chunks.
+        """
+        results = []
         with self._list_lock:
-            ret_set = set()
-            if (not self._transaction) or (not self._transaction.chunks) or self._transaction.abort:
-                print("Creating a new transaction.")
-                # create a new transaction_set
-                self._build_next_transaction()
-                # start the new transaction
-                self._start_transaction()
-
-            # Get chunks to send from self._transaction and remove them
-            # from self._transaction.chunks
-            for chunk in itertools.islice(self._transaction.chunks, req_chunk_count):
-                ret_set.add(chunk)
+            for client_name, client_addr, req_chunk_count in requests:
+                try:
+                    results.append(self._assign_chunks(req_chunk_count))
+                except RuntimeError as e:
+                    results.append(e)
+
+        # The chunks have been removed from the transaction, so no other
+        # thread will modify their client information.
+        for (client_name, client_addr, _), result in zip(requests, results):
+            if isinstance(result, Exception):
+                continue
+            ret_set, transaction_id = result
+            for chunk in ret_set:
                 cInfo = self._chunks_data[chunk]
-                cInfo.gen_stage = GenerationStage.ASSIGNED
                 cInfo.client_id = client_name
                 cInfo.client_addr = client_addr
-            self._chunk_logs.addAssigned(ret_set)
-            print(f"chunks_for client t_id={self._transaction.id} chunks to send={ret_set}")
-            for chunk in ret_set:
-                self._transaction.chunks.discard(chunk)
-        return ret_set, self._transaction.id
+            _log.debug("chunks_for client t_id=%s chunks to send=%s", transaction_id, ret_set)
+        return results
+
+    def _assign_chunks(self, req_chunk_count):
+        """Take up to req_chunk_count chunks from the current transaction,
+        starting a new transaction if needed.
+
+        Note: self._list_lock must be held when calling this function.
+        """
+        if (not self._transaction) or (not self._transaction.chunks) or self._transaction.abort:
+            print("Creating a new transaction.")
+            # create a new transaction_set
+            self._build_next_transaction()
+            # start the new transaction
+            self._start_transaction()
+
+        # Get the lowest numbered chunks to send from self._transaction
+        # and remove them from self._transaction.chunks
+        transaction = self._transaction
+        ret_set = transaction.take(req_chunk_count)
+        self._chunk_logs.addAssigned(ret_set)
+        for chunk in ret_set:
+            self._set_stage(self._chunks_data[chunk], GenerationStage.ASSIGNED)
+        return ret_set, transaction.id
 
     def client_results(self, transaction_id, expected_chunks, completed_chunks):
         """Remove completed_chunks from the transaction, abort if chunks missing.
@@ -398,20 +478,24 @@ class ChunkTracking:
                 print(f"  completed_chunks={completed_chunks}")
                 print(f"  expected_chunks={expected_chunks}")
                 return
+        # Compare outside the lock, only the stage changes need it.
         completed_set = set(completed_chunks)
-        diff = expected_chunks ^ completed_set
-        print(f"t_id={transaction_id} diff={diff}")
+        missing = expected_chunks.difference(completed_set)
+        unexpected = completed_set.difference(expected_chunks)
+        _log.debug("t_id=%s missing=%s unexpected=%s", transaction_id, missing, unexpected)
         with self._list_lock:
             # get the correct transaction
             transaction = self._transaction_dict[transaction_id]
-            if len(diff) > 0:
-                print(f"Error, missing chunks t_id={transaction_id} diff={diff}")
-                # Mark missing chunks as being in limbo.
-                self._chunk_logs.addLimbo(diff)
-                for missing in diff:
-                    cInfo = self._chunks_data[missing]
-                    cInfo.gen_stage = GenerationStage.LIMBO
-                    self._limbo_count += 1
+            if missing or unexpected:
+                print(f"Error, missing chunks t_id={transaction_id} missing={missing} "
+                      f"unexpected={unexpected}")
+                # Mark missing chunks as being in limbo. Unexpected chunks
+                # were not assigned to this client, so leave their stage alone.
+                if missing:
+                    self._chunk_logs.addLimbo(missing)
+                    for chunk in missing:
+                        self._set_stage(self._chunks_data[chunk], GenerationStage.LIMBO)
+                    self._limbo_count += len(missing)
                 # Abort the transaction
                 transaction.abort = True
                 self._close_transaction(transaction_id)
@@ -426,7 +510,7 @@ class ChunkTracking:
                 self._chunk_logs.addCompleted(transaction.completed_chunks)
 
             total_to_send = self._chunks_to_send_total
-            chunks_left = len(self._chunks_to_send_set)
+            chunks_left = len(self._chunks_pending)
             chunks_in_transactions = 0
             for t_id, t_val in self._transaction_dict.items():
                 if not t_val.closed:
@@ -442,5 +526,11 @@ class ChunkTracking:
         print('  processing      =', (total_to_send -
                                       (chunks_left + completed_count + limbo_count)))
 
+    def close(self):
+        """Close the chunk log files kept open for appending.
+        """
+        with self._list_lock:
+            self._chunk_logs.close()
+
 
 
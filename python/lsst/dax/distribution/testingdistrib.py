@@ -99,6 +99,7 @@ class ServerTestThrd(threading.Thread):
                 self.success = False
                 raise RuntimeError("mismatch in sent vs received lists", self.name, diff)
             self.warnings += serv.warnings
+            serv.close()
         print("ServerTestThrd.run finished")
         if self.success is None:
             self.success = True
@@ -186,6 +187,8 @@ class ClientTestThrd(threading.Thread):
             completedChunks = chunkListARecv.copy()
             while len(completedChunks) > 0:
                 completedChunks = client.clientReportChunksComplete(completedChunks)
+            client.flush()
+            client.close()
         print("ClientTestThrd.run finished")
         if self.success is None:
             self.success = True
@@ -227,15 +230,15 @@ def testDataGenConnection(port, name, objects, visits, seed, cfg_file_contents,
 
 def connectionTest():
     cListA = range(26, 235)
-    pCfgFiles = {0: ("obj.cfg", "a lot of obj cfg info"),
-                 1: ("fs.cfg", "some forcedSource info"),
-                 2: ("junk_cfg", "blah blah junk\n more stuff")}
+    pCfgFiles = [("obj.cfg", "a lot of obj cfg info"),
+                 ("fs.cfg", "some forcedSource info"),
+                 ("junk_cfg", "blah blah junk\n more stuff")]
     ingest_dict = {'host': 'mt.st.com', 'port': 2461, 'auth': '1234',
-                   'db': 'afake_db', 'skip': False, 'keep': True}
-    pregen_dict = {0: ("visit_ccd_test.csv", "1,2,3,55,22,10.5,something,4"),
-                   1: ("junk_file.txt", "some other stuff"),
-                   2: ("type.txt", "The quick brown fox jumped over the lazy dog."),
-                   3: ("skey", "asjd43rauydfsf4baeuyrf784r;;!@")}
+                   'db': 'afake_db', 'skip': False, 'keep': True, 'http2': False}
+    pregen_dict = [("visit_ccd_test.csv", "1,2,3,55,22,10.5,something,4"),
+                   ("junk_file.txt", "some other stuff"),
+                   ("type.txt", "The quick brown fox jumped over the lazy dog."),
+                   ("skey", "asjd43rauydfsf4baeuyrf784r;;!@")]
     timing_dict = TimingDict()
     timing_dict.add('gen_o', 345.23)
     timing_dict.add('gen_fs', 981.23)
@@ -251,8 +254,8 @@ def connectionTest():
         exit(1)
 
     ingest_dict = {'host': 'mt.st.edu', 'port': 0, 'auth': '',
-                   'db': 'diff_db', 'skip': True, 'keep': False}
-    pregen_dict = {}
+                   'db': 'diff_db', 'skip': True, 'keep': False, 'http2': True}
+    pregen_dict = []
     timing_dict = TimingDict()
     success, s_warn2, c_warn2 = testDataGenConnection(14242, 'qt', 10000, 30, 1,
                           'bunch of json file entries', 28, cListA,
@@ -261,7 +264,26 @@ def connectionTest():
     print("success=", success, "serv_warn=", s_warn1, s_warn2, "client_warn=", c_warn1, c_warn2)
 
 
-def dataIngestTest():
+def dataIngestTest(chunk_files=None, transaction_size=100):
+    """Send chunk files to the ingest system and publish the database.
+
+    Parameters
+    ----------
+    chunk_files : list of tuple, optional
+        (chunk_id, table, f_path) for each file to ingest. The default
+        is the chunk 0 Object table test file.
+    transaction_size : int, optional
+        Maximum number of distinct chunks ingested under one transaction,
+        all the files of a chunk go in the same transaction.
+
+    Note
+    ----
+    Each transaction costs a start and an end request, so chunks are
+    grouped into transactions of up to transaction_size chunks, with
+    the worker addresses for a group looked up together.
+    """
+    if chunk_files is None:
+        chunk_files = [(0, 'Object', 'configs/fakeIngestCfgsTest/chunk_0.txt')]
     ingest = DataIngest.DataIngest('localhost', 25080)
     # No point in continuing if the ingest system can't be contacted.
     if not ingest.isIngestAlive():
@@ -274,26 +296,33 @@ def dataIngestTest():
     # database already exists.
     if not ingest.registerTable("configs/fakeIngestCfgsTest/test102_Object.json"):
         print("ERROR failed to send Object table schema")
-    # Start a transaction
-    i_transaction = DataIngest.IngestTransaction(ingest, 'test102')
+    # Files by chunk id, so all the tables of a chunk go in the same transaction.
+    files_by_chunk = {}
+    for chunk_file in chunk_files:
+        files_by_chunk.setdefault(chunk_file[0], []).append(chunk_file)
+    chunk_ids = list(files_by_chunk)
     transaction_status = None
-    try:
-        with i_transaction as t_id:
-            chunk_id = 0
-            # Get address of worker to handle this chunk.
-            host, port = ingest.getChunkTargetAddr(t_id, chunk_id)
-            # Send the chunk to the target worker
-            table = 'Object'
-            f_path = 'configs/fakeIngestCfgsTest/chunk_0.txt'
-            out_str = ingest.sendChunkToTarget(host, port, t_id, table, f_path)
-            print('host=', host, 'port=', port, "", out_str)
-            i_transaction.abort = False
-            # Transaction ends
-        transaction_status = True
-    except RuntimeError as err:
-        transaction_status = False
-        print("Transaction Failed ", i_transaction, "err=", err)
-        exit(1)
+    for pos in range(0, len(chunk_ids), transaction_size):
+        group_ids = chunk_ids[pos:pos + transaction_size]
+        group = [chunk_file for chunk_id in group_ids for chunk_file in files_by_chunk[chunk_id]]
+        # Start a transaction
+        i_transaction = DataIngest.IngestTransaction(ingest, 'test102')
+        try:
+            with i_transaction as t_id:
+                # Get addresses of the workers to handle these chunks,
+                # submit() then finds them in the cache.
+                ingest.getChunkTargetAddrs(t_id, group_ids)
+                futures = [i_transaction.submit(chunk_id, table, f_path)
+                           for chunk_id, table, f_path in group]
+                i_transaction.abort = False
+                # Transaction ends once all the chunks are sent.
+            for (chunk_id, table, f_path), fut in zip(group, futures):
+                print('chunk=', chunk_id, table, fut.result())
+            transaction_status = True
+        except RuntimeError as err:
+            transaction_status = False
+            print("Transaction Failed ", i_transaction, "err=", err)
+            exit(1)
     # code to publish
     success, status, content = ingest.publishDatabase('test102')
     if not success:
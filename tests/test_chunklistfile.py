@@ -1,4 +1,5 @@
 
+import tempfile
 import unittest
 
 import lsst.dax.distribution.chunklogs as chunklogs
@@ -81,6 +82,17 @@ class ChunkListFileTests(unittest.TestCase):
         tdata.good_set.update(to_add)
         self.assertSetEqual(clf.chunk_set, tdata.good_set)
 
+    def testToStrDsk(self):
+        clf = chunklogs.ChunkListFile(None)
+        self.assertEqual(clf.toStrDsk(set()), '')
+        self.assertEqual(clf.toStrDsk({8, 0, 1, 2, 3, 5, 7, 100}), '0:3\n5\n7:8\n100')
+
+        tdata = TData()
+        clf.parse(tdata.good_raw)
+        clf_r = chunklogs.ChunkListFile(None)
+        clf_r.parse(clf.toStr())
+        self.assertSetEqual(clf_r.chunk_set, tdata.good_set)
+
     def testWriteRead(self):
         dummyf = "/tmp/tmpchunktest"
         tdata = TData()
@@ -117,7 +129,7 @@ class ChunkListFileTests(unittest.TestCase):
         clogs_out.addLimbo(tdata.limbo)
         clogs_out.addAssigned(tdata.assigned)
 
-        tf, cf, af, lf = chunklogs.ChunkLogs.createNames("/tmp")
+        tf, cf, af, lf, _, _ = chunklogs.ChunkLogs.createNames("/tmp")
         clogs_read = chunklogs.ChunkLogs(tf, cf, af, lf)
 
         clogs_read.build(tdata.valid_ids)
@@ -128,6 +140,16 @@ class ChunkListFileTests(unittest.TestCase):
 
         self.assertSetEqual(clogs_read.result_set, set(tdata.result_expected))
 
+    def testCheckFiles(self):
+        with tempfile.TemporaryDirectory() as in_dir:
+            self.assertRaises(FileNotFoundError, chunklogs.ChunkLogs.checkFiles, in_dir)
+            tf, cf, af, lf, _, _ = chunklogs.ChunkLogs.createNames(in_dir)
+            for fname in (tf, cf):
+                with open(fname, 'w') as f:
+                    f.write('1\n')
+            # Missing files come back as None so build() doesn't read them.
+            self.assertEqual(chunklogs.ChunkLogs.checkFiles(in_dir), (tf, cf, None, None))
+
     def testChunkFileLists(self):
         tdata = TData()
         clogs = chunklogs.ChunkLogs(None, raw=tdata.lists_raw)
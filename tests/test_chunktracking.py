@@ -71,7 +71,7 @@ class ChunkTrackingTests(unittest.TestCase):
                             'db': db_name, 'skip': skip_ingest, 'keep': keep_csv}
             c_t = chunktracking.ChunkTracking(local_chunker, clfs, 100, skip_ingest, skip_schema, log_dir,
                                             ingest_dict)
-            self.assertSetEqual(c_t._chunks_to_send_set, valid_chunks)
+            self.assertSetEqual(set(c_t._chunks_pending), valid_chunks)
 
             client_chunks, transaction_id = c_t.get_chunks_for_client(7, "some.pc.edu", 5)
             print(f"t_id={transaction_id} client_chunks={client_chunks}")
@@ -82,6 +82,8 @@ class ChunkTrackingTests(unittest.TestCase):
             self.assertSetEqual(c_t._transaction.total_chunks, c_t._transaction.chunks.union(client_chunks))
             self.assertTrue(c_t._transaction.total_chunks != c_t._transaction.chunks)
             self.assertTrue(c_t._transaction.chunks.isdisjoint(client_chunks))
+            # Chunks are handed out lowest id first.
+            self.assertSetEqual(client_chunks, set(sorted(valid_chunks)[:5]))
 
             # Pretend that the chunks were sent to the client and the client created all of them
             completed_chunks = client_chunks.copy()
@@ -104,8 +106,8 @@ class ChunkTrackingTests(unittest.TestCase):
                 chunks_in_all_transactions = set()
                 for t_id, t_val in c_t._transaction_dict.items():
                     chunks_in_all_transactions = chunks_in_all_transactions | t_val.total_chunks
-                self.assertTrue(c_t._chunks_to_send_set.isdisjoint(chunks_in_all_transactions))
-                union_to_send_all_trans = c_t._chunks_to_send_set | chunks_in_all_transactions
+                self.assertTrue(chunks_in_all_transactions.isdisjoint(c_t._chunks_pending))
+                union_to_send_all_trans = set(c_t._chunks_pending) | chunks_in_all_transactions
                 self.assertSetEqual(c_t._chunks_entire_set, union_to_send_all_trans)
 
                 # Pretend that the chunks were sent to the client and the client created all of them
@@ -116,6 +118,10 @@ class ChunkTrackingTests(unittest.TestCase):
 
             self.assertTrue(c_t._transaction.closed)
             self.assertFalse(c_t._transaction.abort)
-            self.assertTrue(len(c_t._chunks_to_send_set) == 0)
+            self.assertTrue(len(c_t._chunks_pending) == 0)
             self.assertSetEqual(c_t._chunks_entire_set, c_t._chunk_logs._completed.chunk_set)
+            finished = c_t.chunksInState([chunktracking.GenerationStage.FINISHED])
+            self.assertSetEqual(set(c_info.chunk_id for c_info in finished), c_t._chunks_entire_set)
+            self.assertFalse(c_t.chunksInState([chunktracking.GenerationStage.UNASSIGNED,
+                                                chunktracking.GenerationStage.ASSIGNED]))
         return
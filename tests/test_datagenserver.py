@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import threading
+import time
+import unittest
+
+from lsst.dax.distribution.DataGenServer import ChunkRequestBatcher
+
+
+class FakeChunkTracking:
+    """Records the batches of requests it is given."""
+
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+
+    def get_chunks_for_clients(self, requests):
+        self.batches.append(requests)
+        if self.fail:
+            raise RuntimeError("tracking failed")
+        return [([count], 7) for name, addr, count in requests]
+
+
+class ChunkRequestBatcherTests(unittest.TestCase):
+
+    def testQueuedRequestsBatched(self):
+        tracking = FakeChunkTracking()
+        batcher = ChunkRequestBatcher(tracking)
+        futs = [batcher.request(f'c{j}', 'addr', j + 1) for j in range(3)]
+        batcher.stop()
+        start = time.monotonic()
+        batcher.serve()
+        # A window of 0 never sleeps waiting for more requests.
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertEqual(len(tracking.batches), 1)
+        self.assertEqual([fut.result() for fut in futs], [([1], 7), ([2], 7), ([3], 7)])
+
+    def testSingleRequestNotDelayed(self):
+        batcher = ChunkRequestBatcher(FakeChunkTracking())
+        thrd = threading.Thread(target=batcher.serve)
+        thrd.start()
+        try:
+            fut = batcher.request('c0', 'addr', 4)
+            self.assertEqual(fut.result(timeout=5), ([4], 7))
+        finally:
+            batcher.stop()
+            thrd.join()
+
+    def testTrackingErrorSetOnFutures(self):
+        batcher = ChunkRequestBatcher(FakeChunkTracking(fail=True))
+        fut = batcher.request('c0', 'addr', 4)
+        batcher.stop()
+        batcher.serve()
+        self.assertRaises(RuntimeError, fut.result)